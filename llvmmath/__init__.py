@@ -15,6 +15,8 @@ logging.getLogger("llvmpy").setLevel(logging.WARN)
 
 from .build import have_llvm_asm, have_clang
 from .libs import get_default_math_lib, get_mathlib_so, get_llvm_mathlib
+from .libs import get_partial_llvm_mathlib
+from .libs import get_native_mathlib_so, get_native_llvm_mathlib
 from .libs import get_libm, get_openlibm
 
 # ______________________________________________________________________
@@ -26,14 +28,17 @@ def test(pattern=pattern):
     """Run tests and return exit status"""
     # We can't use unittest's discover feature, since it's new in 2.7
     # We can't have a dependency on unittest2
-    from llvmmath.tests import (test_abi, test_build, test_libs, test_linking,
-                                test_parsesyms, test_symbols)
+    from llvmmath.tests import (test_abi, test_aot, test_build, test_kernels,
+                                test_libs, test_linking, test_objcache,
+                                test_parsesyms, test_profiling, test_symbols,
+                                test_utils, test_warmup)
 
     # Find and load tests
     tests = []
     loader = unittest.TestLoader()
-    for module in (test_abi, test_build, test_libs, test_linking,
-                   test_parsesyms, test_symbols):
+    for module in (test_abi, test_aot, test_build, test_kernels, test_libs,
+                   test_linking, test_objcache, test_parsesyms,
+                   test_profiling, test_symbols, test_utils, test_warmup):
         print(module.__name__, pattern)
         if fnmatch.fnmatch(module.__name__, pattern):
             tests.extend(loader.loadTestsFromModule(module))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ahead-of-time compilation of LLVM modules (with linked math) to shared
+libraries, which can be loaded without generating any code at runtime.
+
+    >>> linking.link_llvm_math_intrinsics(engine, module, lib, linker, repls)
+    >>> aot.compile_module(module, 'kernels.so')
+
+and later, possibly in another process:
+
+    >>> aot.load_module('kernels.so', py_module)
+    >>> py_module.my_func(...)
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import ctypes
+import shutil
+import tempfile
+from os.path import join, abspath
+from distutils import ccompiler, sysconfig
+
+from . import llvm_support
+
+import llvm.core
+import llvm.ee as le
+
+# ______________________________________________________________________
+
+def pic_target_machine(opt=2, cpu='', features=''):
+    "Get a target machine generating position independent code"
+    return le.TargetMachine.new(cpu=cpu, features=features, opt=opt,
+                                reloc=le.RELOC_PIC)
+
+def link_shared(objfile, outfile):
+    "Link an object file into a shared library with the default C compiler"
+    compiler = ccompiler.new_compiler()
+    sysconfig.customize_compiler(compiler)
+    compiler.link_shared_object([objfile], outfile, libraries=['m'])
+
+def emit_shared(target_machine, module, outfile, tempdir=None):
+    """
+    Generate native code for the module and link it to a shared library.
+    Intermediate files go to a temporary directory created in tempdir.
+    """
+    builddir = tempfile.mkdtemp(dir=tempdir)
+    try:
+        objfile = join(builddir, 'module.o')
+        with open(objfile, 'wb') as fout:
+            fout.write(target_machine.emit_object(module))
+        link_shared(objfile, outfile)
+    finally:
+        shutil.rmtree(builddir)
+
+#===------------------------------------------------------------------===
+# Engines
+#===------------------------------------------------------------------===
+
+class SharedLibraryEngine(object):
+    """
+    Stand-in for an llvm execution engine for an LLVM module compiled to a
+    shared library. Implements what llvm_support.get_ctypes_wrapper and
+    llvm_support.wrap_llvm_module need.
+    """
+
+    def __init__(self, dll):
+        self.dll = dll
+
+    def get_pointer_to_function(self, lfunc):
+        try:
+            func = self.dll[lfunc.name]
+        except AttributeError:
+            raise LookupError("Function %s is not exported by %s" % (
+                                            lfunc.name, self.dll._name))
+        return ctypes.cast(func, ctypes.c_void_p).value
+
+    def get_pointer_to_global(self, gv):
+        try:
+            var = ctypes.c_char.in_dll(self.dll, gv.name)
+        except ValueError:
+            raise LookupError("Global %s is not exported by %s" % (
+                                            gv.name, self.dll._name))
+        return ctypes.addressof(var)
+
+    def add_global_mapping(self, gv, ptr):
+        raise ValueError(
+            "Cannot map %s to an address: modules compiled to native code "
+            "must be self-contained (use the LLVMLinker)" % (gv.name,))
+
+#===------------------------------------------------------------------===
+# Public interface
+#===------------------------------------------------------------------===
+
+def compile_module(module, outfile, opt=2, cpu='', features=''):
+    """
+    Compile an LLVM module to the shared library outfile. The module must be
+    self-contained, i.e. math must be linked with the LLVMLinker. The module's
+    bitcode is saved as outfile + '.bc' to provide the function signatures
+    when loading.
+
+    The default cpu and features target the host. To deploy on other
+    machines, select a conservative cpu explicitly.
+    """
+    emit_shared(pic_target_machine(opt, cpu, features), module, outfile)
+    with open(outfile + '.bc', 'wb') as fout:
+        module.to_bitcode(fout)
+
+def load_module(filename, py_module):
+    """
+    Load a shared library produced by compile_module() and populate py_module
+    with ctypes wrappers of its public functions, like
+    llvm_support.wrap_llvm_module().
+    """
+    with open(filename + '.bc', 'rb') as fin:
+        llvm_module = llvm.core.Module.from_bitcode(fin)
+
+    engine = SharedLibraryEngine(ctypes.CDLL(abspath(filename)))
+    llvm_support.wrap_llvm_module(llvm_module, engine, py_module)
+    setattr(py_module, '_llvm_module', llvm_module)
+    setattr(py_module, '_llvm_engine', engine)
+    return py_module
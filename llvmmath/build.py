@@ -8,15 +8,25 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import sys
+import json
+import shutil
+import hashlib
 import logging
-from distutils import sysconfig
-from functools import partial
+import tempfile
+from distutils import sysconfig, ccompiler
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from collections import namedtuple
-from os.path import join, dirname, abspath, exists
+from os.path import join, dirname, abspath, exists, basename, splitext
 from subprocess import call, check_call, PIPE
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from .utils import cached
-from .generator import generate_config
+from .generator import generate_config, conv_template
 
 import llvm.core
 import numpy as np
@@ -38,10 +48,32 @@ includes = ['-I' + abspath(dir) for dir in incdirs]
 # Build Targets
 #===------------------------------------------------------------------===
 
-def build_llvm(config):
-    "Compile math library to bitcode with clang"
-    outfile = join(config.output_dir, 'mathcode.s')
-    # use the most generic target triple
+# Translation units of the math library, one per function family. These are
+# compiled in parallel and linked together.
+families = [
+    ('funcs',    'funcs.c'),
+    ('integer',  'npy_math_integer.c'),
+    ('floating', 'npy_math_floating.c'),
+    ('complex',  'npy_math_complex.c'),
+    ('half',     'npy_math_half.c'),
+    ('ieee754',  'ieee754.c'),
+]
+
+def parallel_map(config, f, items):
+    "Map f over items using a pool of config.jobs worker threads"
+    items = list(items)
+    if config.jobs <= 1 or len(items) <= 1:
+        return list(map(f, items))
+
+    pool = ThreadPool(min(config.jobs, len(items)))
+    try:
+        return pool.map(f, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def llvm_target():
+    "Get the most generic target triple for the host"
     ## arch
     if tuple.__itemsize__ == 8:
         target = 'x86_64'
@@ -56,24 +88,130 @@ def build_llvm(config):
         target += '-linux'
     else: # unknown platform, maybe it does not need the OS info
         pass
+    return target
+
+def compile_llvm(config, source, outfile, assembly=True):
+    "Compile a C file from mathcode/ to LLVM assembly or bitcode with clang"
     # Disable optimization to leave more information to the client.
     # The client can then specialize to the specific hardware just-in-time.
-    check_call([config.clang, '-O0', '-target', target, '-c', 'mathcode.c',
-                '-S', '-emit-llvm', '-o', outfile] + includes,
+    check_call([config.clang, '-O0', '-target', llvm_target(), '-c', source,
+                '-emit-llvm', '-o', outfile] + (['-S'] if assembly else []) +
+               includes,
                cwd=mathcode)
 
+def build_llvm(config):
+    """
+    Compile math library to LLVM assembly with clang. When llvm-link is
+    available, every function family is also kept as a separate bitcode
+    module, along with an index (see build_llvm_index). Otherwise the index
+    and modules of an earlier build are deleted, as they would be outdated.
+    """
+    outfile = join(config.output_dir, 'mathcode.s')
+    if not have_llvm_link(config.llvm_link):
+        remove_llvm_index(config)
+        compile_llvm(config, 'mathcode.c', outfile)
+        return
+
+    def compile_family(family):
+        name, source = family
+        partfile = join(config.output_dir, 'mathcode_%s.bc' % name)
+        compile_llvm(config, source, partfile, assembly=False)
+        return name, partfile
+
+    parts = parallel_map(config, compile_family, families)
+    check_call([config.llvm_link, '-S', '-o', outfile] +
+               [partfile for name, partfile in parts])
+    build_llvm_index(config, parts)
+
+def build_llvm_index(config, parts):
+    """
+    Write an index of the per-family bitcode modules, mapping each symbol to
+    the family defining it, and each family to the families it depends on:
+
+        { "modules": { family: { "file": fn, "requires": [family, ...] } },
+          "symbols": { symbol_name: family } }
+    """
+    defined = {}  # symbol -> family
+    required = {} # family -> set([symbol])
+    for name, partfile in parts:
+        with open(partfile, 'rb') as fin:
+            mod = llvm.core.Module.from_bitcode(fin)
+
+        required[name] = set()
+        for gv in list(mod.functions) + list(mod.global_variables):
+            if gv.is_declaration:
+                required[name].add(gv.name)
+            elif gv.linkage not in (llvm.core.LINKAGE_INTERNAL,
+                                    llvm.core.LINKAGE_PRIVATE):
+                defined[gv.name] = name
+
+    modules = {}
+    for name, partfile in parts:
+        requires = set(defined[sym] for sym in required[name]
+                           if sym in defined)
+        requires.discard(name)
+        modules[name] = { 'file': basename(partfile),
+                          'requires': sorted(requires) }
+
+    index = { 'modules': modules, 'symbols': defined }
+    write_if_changed(join(config.output_dir, 'mathcode.index.json'),
+                     json.dumps(index, indent=4, sort_keys=True))
+
+def remove_llvm_index(config):
+    "Delete the index and per-family bitcode modules of build_llvm"
+    filenames = ['mathcode.index.json']
+    filenames.extend('mathcode_%s.bc' % name for name, source in families)
+    for filename in filenames:
+        if exists(join(config.output_dir, filename)):
+            os.remove(join(config.output_dir, filename))
+
+# Basename of the shared library build_shared writes, distinct from the
+# llvmmath.mathcode.mathcode extension module setup.py builds
+shared_basename = 'libmathcode'
+
+# The C math library is part of the C runtime on Windows
+shared_libraries = [] if sys.platform == 'win32' else ['m']
+
+def build_shared(config):
+    """
+    Compile math library to a shared library with the default C compiler.
+    Not a default target, add it to config.targets to build it.
+    """
+    outfile = join(config.output_dir, shared_basename + find_shared_ending())
+    tempdir = tempfile.mkdtemp()
+
+    def compile_family(source):
+        compiler = ccompiler.new_compiler()
+        sysconfig.customize_compiler(compiler)
+        return compiler.compile([join(mathcode, source)], output_dir=tempdir,
+                                include_dirs=incdirs + [mathcode])
+
+    try:
+        sources = [source for name, source in families]
+        objects = sum(parallel_map(config, compile_family, sources), [])
+
+        compiler = ccompiler.new_compiler()
+        sysconfig.customize_compiler(compiler)
+        compiler.link_shared_object(objects, outfile,
+                                    libraries=shared_libraries)
+    finally:
+        shutil.rmtree(tempdir)
+
 #===------------------------------------------------------------------===
 # Config
 #===------------------------------------------------------------------===
 
-Config = namedtuple('Config', 'clang conv_templ targets log output_dir')
+Config = namedtuple('Config',
+                    'clang llvm_link conv_templ targets log output_dir jobs')
 
 _default_values = {
     'clang':        'clang',
+    'llvm_link':    'llvm-link',
     'conv_templ':   join(root, 'generator', 'conv_template.py'),
-    'targets':      [build_llvm], #, build_shared],
+    'targets':      [build_llvm],
     'log':          logger.info,
     'output_dir':   mathcode,
+    'jobs':         cpu_count(),
 }
 
 default_config = Config(**_default_values)
@@ -90,32 +228,114 @@ def build(config=default_config):
     build_source(config)
     build_targets(config)
 
-def build_source(config=default_config):
-    config.log("Processing source files")
+# Templates in mathcode/ expanded by conv_template to the file without '.src'
+templates = [
+    'funcs.inc.src',
+    'npy_math_integer.c.src',
+    'npy_math_floating.c.src',
+    'npy_math_complex.c.src',
+    'npy_math_half.c.src',
+    'ieee754.c.src',
+]
+
+# Content hashes of the templates and their outputs from the last build,
+# kept in the source directory
+hashfile_name = '.buildhashes.json'
+
+def digest(data):
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def read_file(fn):
+    with open(fn) as fin:
+        return fin.read()
+
+def write_if_changed(fn, data):
+    "Write data to fn unless it already holds it. Returns whether we wrote"
+    if exists(fn) and read_file(fn) == data:
+        return False
+    with open(fn, 'w') as fout:
+        fout.write(data)
+    return True
+
+def load_hashes(source_dir):
+    try:
+        with open(join(source_dir, hashfile_name)) as fin:
+            return json.load(fin)
+    except (EnvironmentError, ValueError):
+        return {}
+
+def save_hashes(source_dir, hashes):
+    write_if_changed(join(source_dir, hashfile_name),
+                     json.dumps(hashes, indent=4, sort_keys=True))
+
+def expand_template(config, fn):
+    """
+    Expand template fn and return the output. The default processor runs
+    in-process. A custom config.conv_templ is invoked as before, as
+    'python conv_templ file.c.src', and writes file.c itself.
+    """
+    if config.conv_templ == _default_values['conv_templ']:
+        return conv_template.process_str(read_file(fn))
+
+    check_call([sys.executable, config.conv_templ, fn])
+    return read_file(splitext(fn)[0])
+
+def process_template(config, fn, hashes):
+    """
+    Expand template fn, unless neither the template, the template processor
+    nor the previously generated output changed. Returns whether the output
+    was regenerated.
+    """
+    outfile = splitext(fn)[0]
+    source = read_file(fn)
+    key = digest(read_file(config.conv_templ) + source)
+
+    previous = hashes.get(basename(fn))
+    if (previous and previous[0] == key and exists(outfile) and
+            digest(read_file(outfile)) == previous[1]):
+        return False
+
+    config.log("Processing %s" % basename(fn))
+    output = expand_template(config, fn)
+    write_if_changed(outfile, output)
+    hashes[basename(fn)] = [key, digest(output)]
+    return True
 
-    args = [sys.executable, config.conv_templ]
-    process = lambda fn: check_call(args + [fn])
-    mkfn = partial(join, mathcode)
+def build_source(config=default_config, source_dir=mathcode):
+    """
+    Expand the source templates in source_dir and write config.h. Only files
+    whose inputs changed since the last build are regenerated. Returns the
+    list of regenerated files.
+    """
+    config.log("Processing source files")
 
-    process(mkfn('funcs.inc.src'))
-    process(mkfn('npy_math_integer.c.src'))
-    process(mkfn('npy_math_floating.c.src'))
-    process(mkfn('npy_math_complex.c.src'))
-    process(mkfn('ieee754.c.src'))
+    hashes = load_hashes(source_dir)
+    processed = [fn for fn in templates
+                    if process_template(config, join(source_dir, fn), hashes)]
+    save_hashes(source_dir, hashes)
 
     # Generate config.h
-    config.log("Writing config.h")
-    f = open(join(mathcode, 'private', 'config.h'), 'w')
-    generate_config.generate_config(f)
+    out = StringIO()
+    generate_config.generate_config(out)
+    config_h = join(source_dir, 'private', 'config.h')
+    if write_if_changed(config_h, out.getvalue()):
+        config.log("Writing config.h")
+        processed.append('config.h')
+
+    return processed
 
 def build_targets(config=default_config):
-    for build_target in config.targets:
+    "Build all configured targets concurrently"
+    def build_target(build_target):
         config.log("Building with target: %s" % build_target.__name__)
         build_target(config)
 
+    parallel_map(config, build_target, config.targets)
+
 # ______________________________________________________________________
 
 asmfile = join(root, 'mathcode', 'mathcode.s')
+indexfile = join(root, 'mathcode', 'mathcode.index.json')
 
 def have_llvm_asm():
     "See whether we have compiled llvm assembly available"
@@ -129,6 +349,13 @@ def have_clang():
     except EnvironmentError:
         return False
 
+def have_llvm_link(llvm_link='llvm-link'):
+    "See whether we have llvm-link to link separately compiled modules"
+    try:
+        return call([llvm_link, '-version'], stdout=PIPE) == 0
+    except EnvironmentError:
+        return False
+
 def load_llvm_asm(asmfile=asmfile):
     "Load the math library as an LLVM module"
     if not exists(asmfile):
@@ -137,5 +364,34 @@ def load_llvm_asm(asmfile=asmfile):
         mod = llvm.core.Module.from_assembly(fin)
     return mod
 
+def load_llvm_index(indexfile=indexfile):
+    "Load the index of per-family bitcode modules, or None if there is none"
+    if not exists(indexfile):
+        return None
+    with open(indexfile) as fin:
+        return json.load(fin)
+
+def resolve_families(index, symbol_names):
+    "Get the families defining the given symbols, including dependencies"
+    modules = index['modules']
+    stack = [index['symbols'][name] for name in symbol_names
+                 if name in index['symbols']]
+    result = set()
+    while stack:
+        family = stack.pop()
+        if family not in result:
+            result.add(family)
+            stack.extend(modules[family]['requires'])
+    return sorted(result)
+
+def load_llvm_families(index, families, indexfile=indexfile):
+    "Load and link the given per-family bitcode modules into one LLVM module"
+    mod = llvm.core.Module.new('mathcode')
+    for family in families:
+        fn = join(dirname(indexfile), index['modules'][family]['file'])
+        with open(fn, 'rb') as fin:
+            mod.link_in(llvm.core.Module.from_bitcode(fin))
+    return mod
+
 if __name__ == '__main__':
     build()
@@ -9,9 +9,27 @@ from __future__ import print_function, division, absolute_import
 from . import ltypes
 
 import llvm.core as lc
+import llvm.ee as le
+
+def has_split_result(signature):
+    """
+    Whether a struct result is computed from scalar arguments, like
+    { sin(x), cos(x) } = sincos(x). The C function returns the fields of the
+    result through one pointer each, e.g. sincos(double, double *, double *).
+    """
+    return (signature.restype.kind == lc.TYPE_STRUCT and
+            not any(arg.kind == lc.TYPE_STRUCT for arg in signature.argtypes))
 
 def convention_cbyref(signature):
-    "Pass complex numbers by reference. The return value is the last argument"
+    """
+    Pass complex numbers by reference. The return value is the last argument,
+    or the last arguments for a split result (see has_split_result).
+    """
+    if has_split_result(signature):
+        args = list(signature.argtypes)
+        args.extend(map(lc.Type.pointer, signature.restype.elements))
+        return ltypes.Signature(lc.Type.void(), args)
+
     args = []
     have_byref = False
     for arg in signature.argtypes:
@@ -27,3 +45,72 @@ def convention_cbyref(signature):
         restype = signature.restype
 
     return ltypes.Signature(restype, args)
+
+#===------------------------------------------------------------------===
+# Native C ABI for complex numbers
+#===------------------------------------------------------------------===
+
+def lower_complex_sysv_x86_64(ty):
+    """
+    Get the types a complex type is passed as under the x86_64 System V ABI,
+    as (argtypes, restype), or None if it is passed in memory:
+
+        { double, double } -> ([double, double], { double, double })
+        { float, float }   -> ([<2 x float>], <2 x float>)
+    """
+    elemty = ty.elements[0]
+    if elemty.kind == lc.TYPE_DOUBLE:
+        return [elemty, elemty], ty
+    elif elemty.kind == lc.TYPE_FLOAT:
+        vecty = lc.Type.vector(elemty, 2)
+        return [vecty], vecty
+    return None # long double complex is passed in memory
+
+def get_complex_lowering(triple):
+    "Get the complex lowering for the target triple, or None if we have none"
+    is_windows = any(os in triple for os in ('win32', 'windows', 'mingw',
+                                             'cygwin'))
+    if triple.startswith('x86_64') and not is_windows:
+        return lower_complex_sysv_x86_64
+    return None
+
+complex_lowering = get_complex_lowering(le.TargetMachine.new().triple)
+
+def lower_complex(ty):
+    "Lower a complex type for the host, see lower_complex_sysv_x86_64"
+    if complex_lowering is not None:
+        return complex_lowering(ty)
+    return None
+
+def has_native_complex(signature):
+    """
+    Whether the signature has complex arguments or results that the host C
+    ABI passes in registers (and none that it passes in memory).
+    """
+    types = [signature.restype] + list(signature.argtypes)
+    complex_types = [ty for ty in types if ty.kind == lc.TYPE_STRUCT]
+    return (bool(complex_types) and not has_split_result(signature) and
+            all(lower_complex(ty) is not None for ty in complex_types))
+
+def convention_cbyval(signature):
+    """
+    Pass complex numbers by value in registers, following the host C ABI
+    for the corresponding C complex or struct types. Signatures with complex
+    types that are passed in memory (long double complex), or any complex
+    types on hosts without a lowering, use convention_cbyref.
+    """
+    if not has_native_complex(signature):
+        return convention_cbyref(signature)
+
+    args = []
+    for arg in signature.argtypes:
+        if arg.kind == lc.TYPE_STRUCT:
+            args.extend(lower_complex(arg)[0])
+        else:
+            args.append(arg)
+
+    restype = signature.restype
+    if restype.kind == lc.TYPE_STRUCT:
+        restype = lower_complex(restype)[1]
+
+    return ltypes.Signature(restype, args)
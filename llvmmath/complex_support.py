@@ -6,7 +6,7 @@ Support for creating wrappers
 
 from __future__ import print_function, division, absolute_import
 
-from . import ltypes
+from . import ltypes, callconv
 
 import llvm
 import llvm.core as lc
@@ -37,6 +37,157 @@ def print_complex(mod, builder, *complex_vals):
         printf = mod.get_or_insert_function(printf_ty, 'printf')
         builder.call(printf, [builder.bitcast(fmtstring, str_ty), real, imag])
 
+#===------------------------------------------------------------------===
+# Complex arithmetic
+#===------------------------------------------------------------------===
+
+def complex_constant(ty, value):
+    "Create a constant of complex type ty from a Python number"
+    value = complex(value)
+    elemty = ty.elements[0]
+    return lc.Constant.struct([lc.Constant.real(elemty, value.real),
+                               lc.Constant.real(elemty, value.imag)])
+
+class ComplexBuilder(object):
+    """
+    Emit complex arithmetic on { T, T } values. The operations compute
+    exactly what nc_prod, nc_quot, etc in mathcode/funcs.inc.src compute.
+    """
+
+    def __init__(self, builder, ty):
+        self.builder = builder
+        self.ty = ty # { T, T }
+
+    def constant(self, value):
+        "Create a complex constant from a Python number"
+        return complex_constant(self.ty, value)
+
+    def parts(self, z):
+        b = self.builder
+        return b.extract_value(z, 0), b.extract_value(z, 1)
+
+    def pack(self, real, imag):
+        b = self.builder
+        z = b.insert_value(lc.Constant.undef(self.ty), real, 0)
+        return b.insert_value(z, imag, 1)
+
+    def neg(self, x):
+        b = self.builder
+        real, imag = self.parts(x)
+        negzero = lc.Constant.real(real.type, -0.0) # fsub -0.0, x is fneg
+        return self.pack(b.fsub(negzero, real), b.fsub(negzero, imag))
+
+    def sum(self, x, y):
+        b = self.builder
+        (ar, ai), (br, bi) = self.parts(x), self.parts(y)
+        return self.pack(b.fadd(ar, br), b.fadd(ai, bi))
+
+    def diff(self, x, y):
+        b = self.builder
+        (ar, ai), (br, bi) = self.parts(x), self.parts(y)
+        return self.pack(b.fsub(ar, br), b.fsub(ai, bi))
+
+    def prod(self, x, y):
+        b = self.builder
+        (ar, ai), (br, bi) = self.parts(x), self.parts(y)
+        return self.pack(b.fsub(b.fmul(ar, br), b.fmul(ai, bi)),
+                         b.fadd(b.fmul(ar, bi), b.fmul(ai, br)))
+
+    def quot(self, x, y, fast=False):
+        """
+        Divide x by y. With 'fast', multiply by the reciprocal of the squared
+        norm of y instead of dividing twice, which rounds once more.
+        """
+        b = self.builder
+        (ar, ai), (br, bi) = self.parts(x), self.parts(y)
+        d = b.fadd(b.fmul(br, br), b.fmul(bi, bi))
+        real = b.fadd(b.fmul(ar, br), b.fmul(ai, bi))
+        imag = b.fsub(b.fmul(ai, br), b.fmul(ar, bi))
+        if fast:
+            inv = b.fdiv(lc.Constant.real(d.type, 1.0), d)
+            return self.pack(b.fmul(real, inv), b.fmul(imag, inv))
+        return self.pack(b.fdiv(real, d), b.fdiv(imag, d))
+
+    def is_zero(self, z):
+        "Emit an i1 that is set when z == 0"
+        b = self.builder
+        real, imag = self.parts(z)
+        zero = lc.Constant.real(real.type, 0.0)
+        return b.and_(b.fcmp(lc.FCMP_OEQ, real, zero),
+                      b.fcmp(lc.FCMP_OEQ, imag, zero))
+
+#===------------------------------------------------------------------===
+# Native complex ABI
+#===------------------------------------------------------------------===
+
+def _index(i):
+    return lc.Constant.int(lc.Type.int(32), i)
+
+def lower_complex_value(builder, z, types):
+    """
+    Convert complex value z to the values of the given types it is passed as
+    in the native ABI (see callconv.lower_complex), e.g.
+
+        { float, float } -> [<2 x float>]
+        { double, double } -> [double, double]
+    """
+    fields = [builder.extract_value(z, 0), builder.extract_value(z, 1)]
+    values = []
+    for ty in types:
+        if ty.kind == lc.TYPE_VECTOR:
+            value = lc.Constant.undef(ty)
+            for i in range(ty.count):
+                value = builder.insert_element(value, fields.pop(0), _index(i))
+        elif ty.kind == lc.TYPE_STRUCT:
+            value = lc.Constant.undef(ty)
+            for i in range(ty.element_count):
+                value = builder.insert_value(value, fields.pop(0), i)
+        else:
+            value = fields.pop(0)
+        values.append(value)
+
+    assert not fields, (str(z.type), list(map(str, types)))
+    return values
+
+def raise_complex_value(builder, values, ty):
+    """
+    Convert the values a complex number is passed as in the native ABI to a
+    complex value of type ty. The inverse of lower_complex_value.
+    """
+    fields = []
+    for value in values:
+        if value.type.kind == lc.TYPE_VECTOR:
+            fields.extend(builder.extract_element(value, _index(i))
+                              for i in range(value.type.count))
+        elif value.type.kind == lc.TYPE_STRUCT:
+            fields.extend(builder.extract_value(value, i)
+                              for i in range(value.type.element_count))
+        else:
+            fields.append(value)
+
+    real, imag = fields
+    z = builder.insert_value(lc.Constant.undef(ty), real, 0)
+    return builder.insert_value(z, imag, 1)
+
+def emit_native_call(builder, lfunc, args, restype):
+    """
+    Call lfunc, which passes complex numbers following the native ABI (see
+    callconv.convention_cbyval), with by-value arguments. Returns the result
+    as a value of type restype.
+    """
+    native_args = []
+    for arg in args:
+        if arg.type.kind == lc.TYPE_STRUCT:
+            argtypes, _ = callconv.lower_complex(arg.type)
+            native_args.extend(lower_complex_value(builder, arg, argtypes))
+        else:
+            native_args.append(arg)
+
+    result = builder.call(lfunc, native_args)
+    if restype.kind == lc.TYPE_STRUCT:
+        result = raise_complex_value(builder, [result], restype)
+    return result
+
 #===------------------------------------------------------------------===
 # Function wrapping
 #===------------------------------------------------------------------===
@@ -48,6 +199,13 @@ def have_lfunc(mod, name):
     except llvm.LLVMException:
         return False
 
+def have_global(mod, name):
+    try:
+        mod.get_global_variable_named(name)
+        return True
+    except llvm.LLVMException:
+        return False
+
 def create_byref_wrapper(wrapped, name):
     """
     Create an llvm function wrapper that takes arguments by reference, since
@@ -104,3 +262,42 @@ def create_val2ref_wrapper(wrapped, name, func_ty):
     b.ret(b.load(ret))
 
     return lfunc
+
+def create_val2split_wrapper(wrapped, name, func_ty):
+    """
+    Create function wrapper for a math call returning a struct of scalars
+    through a pointer for each field, like sincos(). Take arguments by
+    value and return the struct by value.
+
+        { double, double } wrapper_sincos(double x) {
+            { double, double } out; npy_sincos(x, &out.0, &out.1); return out;
+        }
+
+    :param wrapped: function to call
+    :param name: name of the wrapper
+    :param func_ty: type of the wrapper. Field pointers are bitcast to
+                    wrapped.type
+    """
+    mod = wrapped.module
+
+    restype = func_ty.return_type
+    nfields = len(restype.elements)
+    dst_fieldtys = wrapped.type.pointee.args[-nfields:]
+
+    lfunc = mod.add_function(func_ty, name)
+
+    bb = lfunc.append_basic_block('entry')
+    b = lc.Builder.new(bb)
+
+    ret = b.alloca(restype, 'result')
+
+    zero = lc.Constant.int(lc.Type.int(32), 0)
+    fieldptrs = []
+    for i, dst_fieldty in enumerate(dst_fieldtys):
+        idx = lc.Constant.int(lc.Type.int(32), i)
+        fieldptrs.append(b.bitcast(b.gep(ret, [zero, idx]), dst_fieldty))
+
+    b.call(wrapped, list(lfunc.args) + fieldptrs)
+    b.ret(b.load(ret))
+
+    return lfunc
@@ -19,7 +19,10 @@ need_define = [
     'SIN', 'COS', 'TAN', 'SINH', 'COSH', 'TANH', 'FABS', 'FLOOR',
     'CEIL', 'SQRT', 'LOG10', 'LOG', 'EXP', 'ASIN', 'ACOS', 'ATAN',
     'FMOD', 'MODF', 'FREXP', 'LDEXP', 'RINT', 'TRUNC', 'EXP2',
-    'LOG2', 'ATAN2', 'POW', 'NEXTAFTER', 'COPYSIGN',
+    'LOG2', 'ATAN2', 'POW', 'NEXTAFTER', 'COPYSIGN', 'FMA',
+    'ERF', 'ERFC', 'LGAMMA', 'TGAMMA', 'CBRT',
+    # GNU extensions
+    'SINCOS', 'EXP10',
     # Complex
     'CREAL', 'CIMAG', 'CABS', 'CARG', 'CEXP', 'CSQRT', 'CLOG',
     'CCOS', 'CSIN', 'CPOW',
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Array kernels for the complex math functions, from the shared library in
+mathcode/. Complex numbers are either split into arrays of real and
+imaginary parts (structure of arrays), or interleaved like numpy complex
+arrays:
+
+    >>> rr, ri = kernels.split('sin', xr, xi)
+    >>> r = kernels.interleaved('pow', x, y)
+
+Kernels for real math functions on numpy.float16 arrays compute in float
+element by element, without converting whole arrays first:
+
+    >>> r = kernels.half('exp', x)
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import ctypes
+
+import numpy as np
+
+from . import libs
+
+# ______________________________________________________________________
+
+unary = ['sqrt', 'rint', 'log', 'log1p', 'exp', 'exp2', 'expm1', 'acos',
+         'acosh', 'asin', 'asinh', 'atan', 'atanh', 'cos', 'cosh', 'log10',
+         'log2', 'sin', 'sinh', 'tan', 'tanh', 'neg', 'abs']
+binary = ['pow', 'sum', 'diff', 'prod', 'quot']
+
+# { real dtype : suffix }
+suffixes = {
+    np.dtype(np.float32): 'f',
+    np.dtype(np.float64): '',
+    np.dtype(np.longdouble): 'l',
+}
+
+complex_dtypes = {
+    np.dtype(np.float32): np.dtype(np.complex64),
+    np.dtype(np.float64): np.dtype(np.complex128),
+    np.dtype(np.longdouble): np.dtype(np.clongdouble),
+}
+
+def get_kernel(name, layout, dtype):
+    """
+    Get the kernel of complex function 'name' for layout 'split' or
+    'interleaved' and the real dtype of the complex numbers.
+    """
+    if name not in unary and name not in binary:
+        raise ValueError("No complex kernel for %r" % (name,))
+
+    cname = 'cabs' if name == 'abs' else name
+    symbol = 'nc_%s%s_%s' % (cname, suffixes[np.dtype(dtype)], layout)
+    kernel = getattr(libs.get_mathlib_as_ctypes(), symbol)
+    kernel.restype = None
+    return kernel
+
+def _nargs(name):
+    return 2 if name in binary else 1
+
+def _check_shapes(name, arrays, nexpected):
+    if len(arrays) != nexpected:
+        raise TypeError("%s takes %d arrays, got %d" % (name, nexpected,
+                                                        len(arrays)))
+    shapes = set(a.shape for a in arrays)
+    if len(shapes) != 1:
+        raise ValueError("Arrays must have the same shape, got %s" % (
+                                                        sorted(shapes),))
+
+def _data(a):
+    return a.ctypes.data_as(ctypes.c_void_p)
+
+# ______________________________________________________________________
+
+def split(name, *parts):
+    """
+    Apply complex function 'name' to complex numbers split into real and
+    imaginary arrays, given as real, imag (and real, imag of the second
+    argument for binary functions). Returns (real, imag) of the result, or
+    just the real array for abs.
+    """
+    dtype = np.result_type(np.float32, *parts)
+    parts = [np.ascontiguousarray(part, dtype) for part in parts]
+    _check_shapes(name, parts, 2 * _nargs(name))
+
+    outs = [np.empty_like(parts[0])]
+    if name != 'abs':
+        outs.append(np.empty_like(parts[0]))
+
+    kernel = get_kernel(name, 'split', dtype)
+    kernel(ctypes.c_ssize_t(parts[0].size), *map(_data, parts + outs))
+    return outs[0] if name == 'abs' else tuple(outs)
+
+def interleaved(name, *arrays):
+    """
+    Apply complex function 'name' to numpy complex arrays. Returns a complex
+    array, or a real array for abs.
+    """
+    dtype = np.result_type(np.complex64, *arrays)
+    real_dtype = np.dtype(dtype.char.lower()) # F -> f, D -> d, G -> g
+    arrays = [np.ascontiguousarray(a, complex_dtypes[real_dtype])
+                  for a in arrays]
+    _check_shapes(name, arrays, _nargs(name))
+
+    out_dtype = real_dtype if name == 'abs' else arrays[0].dtype
+    out = np.empty(arrays[0].shape, out_dtype)
+
+    kernel = get_kernel(name, 'interleaved', real_dtype)
+    kernel(ctypes.c_ssize_t(out.size), *map(_data, arrays + [out]))
+    return out
+
+#===------------------------------------------------------------------===
+# Half precision
+#===------------------------------------------------------------------===
+
+half_unary = ['sin', 'cos', 'tan', 'sinh', 'cosh', 'tanh', 'abs', 'floor',
+              'ceil', 'rint', 'trunc', 'sqrt', 'log10', 'log', 'exp', 'expm1',
+              'asin', 'acos', 'atan', 'asinh', 'acosh', 'atanh', 'log1p',
+              'exp2', 'log2', 'erf', 'erfc', 'lgamma', 'tgamma', 'cbrt',
+              'exp10']
+half_binary = ['atan2', 'hypot', 'pow', 'fmod', 'copysign', 'logaddexp',
+               'logaddexp2']
+
+def get_half_kernel(name):
+    "Get the kernel of real function 'name' for numpy.float16 arrays"
+    if name not in half_unary and name not in half_binary:
+        raise ValueError("No half precision kernel for %r" % (name,))
+
+    cname = 'fabs' if name == 'abs' else name
+    kernel = getattr(libs.get_mathlib_as_ctypes(), 'nh_%s_array' % cname)
+    kernel.restype = None
+    return kernel
+
+def _convert(symbol, a, dtype, out_dtype):
+    a = np.ascontiguousarray(a, dtype)
+    out = np.empty(a.shape, out_dtype)
+    convert = getattr(libs.get_mathlib_as_ctypes(), symbol)
+    convert.restype = None
+    convert(ctypes.c_ssize_t(a.size), _data(a), _data(out))
+    return out
+
+def half_to_float(a):
+    "Convert an array to numpy.float16 and then to numpy.float32"
+    return _convert('npy_half_to_float_array', a, np.float16, np.float32)
+
+def float_to_half(a):
+    """
+    Convert an array to numpy.float32 and round it to numpy.float16, to
+    nearest even
+    """
+    return _convert('npy_float_to_half_array', a, np.float32, np.float16)
+
+def half(name, *arrays):
+    """
+    Apply real function 'name' to numpy.float16 arrays (other arrays are
+    converted to float16 first). Returns a float16 array with the results
+    computed in float and rounded to half.
+    """
+    kernel = get_half_kernel(name)
+    arrays = [np.ascontiguousarray(a, np.float16) for a in arrays]
+    _check_shapes(name, arrays, 2 if name in half_binary else 1)
+
+    out = np.empty(arrays[0].shape, np.float16)
+    kernel(ctypes.c_ssize_t(out.size), *map(_data, arrays + [out]))
+    return out
@@ -14,7 +14,8 @@ import collections
 
 from . import build, ltypes, naming, llvm_support, callconv
 from .utils import cached
-from .symbols import CtypesMath, LLVMMath, get_symbols
+from .symbols import CtypesMath, LLVMMath, get_symbols, required_symbols
+from .symbols import symbol_signatures
 
 import llvm.core
 import llvm.ee
@@ -31,15 +32,33 @@ class Library(object):
 
         # # { func_name : { signature : link_obj } }
         self.symbols = collections.defaultdict(dict)
+        # { func_name : { signature : attributes } }, see parsesyms
+        self.attributes = collections.defaultdict(dict)
         self.missing = [] # (name, cname, sig)
 
-    def add_symbol(self, name, sig, val):
+    def add_symbol(self, name, sig, val, attrs=()):
         assert sig not in self.symbols[name], (sig, self.symbols)
         self.symbols[name][sig] = val
+        self.attributes[name][sig] = tuple(attrs)
 
     def get_symbol(self, name, signature):
         return self.symbols.get(name, {}).get(signature)
 
+    def get_attributes(self, name, signature):
+        return self.attributes.get(name, {}).get(signature, ())
+
+    def passes_complex_byval(self, signature):
+        "Whether complex numbers of the signature are passed by value"
+        return (self.calling_convention is callconv.convention_cbyval and
+                callconv.has_native_complex(signature))
+
+    def ctypes_signature(self, signature):
+        "Get the signature to call a symbol with through ctypes"
+        if self.passes_complex_byval(signature):
+            # ctypes passes structures by value following the C ABI
+            return signature
+        return self.calling_convention(signature)
+
     def format_linkable(self, linkable):
         return str(linkable)
 
@@ -61,7 +80,7 @@ class CtypesLibrary(Library):
     def get_ctypes_symbol(self, name, signature):
         ptr = self.get_symbol(name, signature)
         assert ptr is not None, (name, signature)
-        native_sig = self.calling_convention(signature)
+        native_sig = self.ctypes_signature(signature)
         to_ctypes = llvm_support.map_llvm_to_ctypes
 
         sym = ctypes.cast(ptr, ctypes.CFUNCTYPE(None))
@@ -70,14 +89,41 @@ class CtypesLibrary(Library):
         return sym
 
 class LLVMLibrary(Library):
+
+    # llvmmath.objcache.ObjectCache to reuse native code across processes
+    object_cache = None
+
+    def __init__(self, module, calling_conv):
+        super(LLVMLibrary, self).__init__(module, calling_conv)
+        self.engine = None
+
     def format_linkable(self, linkable):
         return linkable.name
 
+    def get_engine(self):
+        "Get the execution engine used to run the library's functions"
+        with llvm_support.context_lock:
+            if self.engine is None:
+                if self.object_cache is not None:
+                    self.engine = self.object_cache.engine(self.module)
+                else:
+                    self.engine = llvm.ee.ExecutionEngine.new(self.module)
+        return self.engine
+
     def get_ctypes_symbol(self, name, signature):
         lfunc = self.get_symbol(name, signature)
         assert lfunc is not None and lfunc.module
-        engine = llvm.ee.ExecutionEngine.new(lfunc.module)
-        return llvm_support.get_ctypes_wrapper(lfunc, engine)
+        with llvm_support.context_lock:
+            engine = self.get_engine()
+            if not self.passes_complex_byval(signature):
+                return llvm_support.get_ctypes_wrapper(lfunc, engine)
+
+            # Complex numbers passed by value, with the ctypes structures for
+            # the LLVM types the C ABI passes them as
+            to_ctypes = llvm_support.map_llvm_to_ctypes
+            functype = ctypes.CFUNCTYPE(to_ctypes(signature.restype),
+                                        *map(to_ctypes, signature.argtypes))
+            return functype(engine.get_pointer_to_function(lfunc))
 
 #===------------------------------------------------------------------===
 # Math symbol manglers
@@ -98,16 +144,24 @@ def mathcode_mangler(name, sig):
     else:
         return umath_mangler(name, sig)
 
+def mathcode_byval_mangler(name, sig):
+    "Use the by-value entry points of complex functions the C ABI supports"
+    cname = mathcode_mangler(name, sig)
+    if cname.startswith('nc_') and callconv.has_native_complex(sig):
+        return 'ncv_' + cname[len('nc_'):]
+    return cname
+
 #===------------------------------------------------------------------===
 # Public Interface
 #===------------------------------------------------------------------===
 
 libmap = { CtypesMath: CtypesLibrary, LLVMMath: LLVMLibrary }
 
-def get_syms(mathlib, libmap=libmap, cc=callconv.convention_cbyref):
+def get_syms(mathlib, libmap=libmap, cc=callconv.convention_cbyref,
+             required_symbols=required_symbols):
     Library = libmap[type(mathlib)]
     library = Library(mathlib.libm, cc)
-    return get_symbols(library, mathlib)
+    return get_symbols(library, mathlib, required_symbols)
 
 # ______________________________________________________________________
 
@@ -139,11 +193,17 @@ def get_openlibm():
 def get_mathlib_as_ctypes():
     "Get the math library as a ctypes CDLL"
     so = build.find_shared_ending()
-    pattern = join(root, 'mathcode', 'mathcode*' + so)
-    dylibs = glob.glob(pattern)
+    # The extension module from setup.py, or the library from build_shared
+    patterns = [join(root, 'mathcode', 'mathcode*' + so),
+                join(root, 'mathcode', build.shared_basename + so)]
+    for pattern in patterns:
+        dylibs = glob.glob(pattern)
+        if dylibs:
+            break
+
     if len(dylibs) != 1 or not exists(dylibs[0]):
         files = os.listdir(join(root, 'mathcode'))
-        raise OSError("File not found: %s. Files: %s" % (pattern, files))
+        raise OSError("File not found: %s. Files: %s" % (patterns, files))
 
     return ctypes.CDLL(dylibs[0])
 
@@ -151,20 +211,70 @@ def get_mathlib_as_ctypes():
 def get_mathlib_so():
     "Load the math from mathcode/ from a shared library"
     llvmmath = get_mathlib_as_ctypes()
-    return get_syms(CtypesMath(llvmmath, mathcode_mangler))
+    return get_syms(CtypesMath(llvmmath, mathcode_mangler, pairs=True))
 
 @cached
 def get_llvm_mathlib():
     "Load the math from mathcode/ from clang-compiled llvm assembly"
     lmath = build.load_llvm_asm()
-    return get_syms(LLVMMath(lmath, mathcode_mangler))
+    return get_syms(LLVMMath(lmath, mathcode_mangler, pairs=True))
+
+@cached
+def get_native_mathlib_so():
+    """
+    Load the math from mathcode/ from a shared library, passing complex
+    numbers by value where the C ABI passes them in registers
+    """
+    llvmmath = get_mathlib_as_ctypes()
+    return get_syms(CtypesMath(llvmmath, mathcode_byval_mangler,
+                               pairs=True),
+                    cc=callconv.convention_cbyval)
+
+@cached
+def get_native_llvm_mathlib():
+    """
+    Load the math from mathcode/ from clang-compiled llvm assembly, passing
+    complex numbers by value where the C ABI passes them in registers
+    """
+    lmath = build.load_llvm_asm()
+    return get_syms(LLVMMath(lmath, mathcode_byval_mangler, pairs=True),
+                    cc=callconv.convention_cbyval)
+
+def get_partial_llvm_mathlib(names):
+    """
+    Load only the parts of the math from mathcode/ needed for the given
+    math functions (e.g. ['sin', 'pow']). Only the per-family bitcode modules
+    defining these functions and their dependencies are parsed. Falls back
+    to the full library if the build did not produce the separate modules.
+    """
+    return _load_partial_llvm_mathlib(tuple(sorted(set(names))))
+
+@cached
+def _load_partial_llvm_mathlib(names):
+    index = build.load_llvm_index()
+    if index is None:
+        return get_llvm_mathlib()
+
+    wanted = [sym for sym in required_symbols if sym.name in names]
+    cnames = [mathcode_mangler(sym.name, sig)
+                  for sym in wanted for sig in symbol_signatures(sym)]
+    families = build.resolve_families(index, cnames)
+
+    lmath = build.load_llvm_families(index, families)
+    return get_syms(LLVMMath(lmath, mathcode_mangler, pairs=True),
+                    required_symbols=wanted)
 
 # ______________________________________________________________________
 # Default library
 
-def get_default_math_lib():
-    "Get the default math library implementation"
+def get_default_math_lib(native=False):
+    """
+    Get the default math library implementation. Complex numbers are passed
+    by reference, or with native=True by value where we know the C ABI of
+    the host (see get_native_llvm_mathlib).
+    """
+    native = native and callconv.complex_lowering is not None
     if build.have_llvm_asm():
-        return get_llvm_mathlib()
+        return get_native_llvm_mathlib() if native else get_llvm_mathlib()
     else:
-        return get_mathlib_so()
+        return get_native_mathlib_so() if native else get_mathlib_so()
@@ -6,48 +6,60 @@ Support for math as a postpass on LLVM IR.
 
 from __future__ import print_function, division, absolute_import
 
+import io
+
 from . import libs
 from . import ltypes
+from . import callconv
+from . import rewrites as math_rewrites
 from . import complex_support
 
 import llvm.core as lc
-from llvmpy.api import llvm
-
-llvm_context = llvm.getGlobalContext()
+import llvm.ee as le
+from .llvm_support import context_lock
 
-#===------------------------------------------------------------------===
-# Complex linking
-#===------------------------------------------------------------------===
+def signature_of(lfunc):
+    "Get the Signature of an LLVM function"
+    fty = lfunc.type.pointee
+    return ltypes.Signature(fty.return_type, fty.args)
 
-def _link_complex(engine, module, library, lfunc_src, lfunc_dst):
+def math_signature(lfunc):
     """
-    Rewrite
-        %r = sin({ double, double}* a)
-    to
-        %a1 = bitcast { double, double}* a to %struct.npy_cdouble*
-        %r = sin(%struct.npy_cdouble* a)
+    Get the Signature of the math function an abstract math function lfunc
+    implements, and whether lfunc passes complex numbers by reference
+    (void f(complex *, complex *)).
     """
-    module, lsrc, ldst = module._ptr, lfunc_src._ptr, lfunc_dst._ptr
-    argtypes = [arg.getType() for arg in ldst.getArgumentList()]
-
-    builder = llvm.IRBuilder.new(llvm_context)
-    for use in lsrc.list_use():
-        if use._downcast(llvm.Instruction).getOpcodeName() == 'call':
-            callinst = use._downcast(llvm.CallInst)
-            builder.SetInsertPoint(callinst)
-            args = [callinst.getOperand(i)
-                        for i in range(callinst.getNumOperands())]
-            # Arguments passed by reference
-            newargs = [builder.CreateBitCast(a, ty)
-                           for a, ty in zip(args, argtypes)]
-            newcall = builder.CreateCall(ldst, newargs)
-            callinst.replaceAllUsesWith(newcall)
-            callinst.eraseFromParent()
-
-    assert not lsrc.list_use(), map(str, lsrc.list_use())
-    lsrc.eraseFromParent()
-
-# ______________________________________________________________________
+    argtypes = lfunc.type.pointee.args
+    restype = lfunc.type.pointee.return_type
+
+    # Complex numbers are passed by reference
+    byref = restype.kind == lc.TYPE_VOID
+    if byref:
+        assert len(argtypes) == 2
+        restype = argtypes[1].pointee
+        argtypes = [argtypes[0].pointee]
+
+    return ltypes.Signature(restype, argtypes), byref
+
+def find_function(module, name, func_ty):
+    "Find a function with the given name and type, or return None"
+    if complex_support.have_lfunc(module, name):
+        lfunc = module.get_function_named(name)
+        if str(lfunc.type.pointee) == str(func_ty):
+            return lfunc
+    return None
+
+def create_wrapper(wrapped, name, func_ty):
+    """
+    Create a wrapper of type func_ty taking and returning values, which calls
+    'wrapped' following convention_cbyref.
+    """
+    sig = ltypes.Signature(func_ty.return_type, func_ty.args)
+    if callconv.has_split_result(sig):
+        create = complex_support.create_val2split_wrapper
+    else:
+        create = complex_support.create_val2ref_wrapper
+    return create(wrapped, name, func_ty)
 
 def link_complex_llvm(lfunc_dst, lfunc_src):
     """
@@ -62,26 +74,61 @@ def link_complex_llvm(lfunc_dst, lfunc_src):
             complex out; nc_sin(&arg, &out); return out;
         }
 
-    nc_sin needs to have been linked into the module.
+    nc_sin needs to have been linked into the module. Functions with a split
+    result are wrapped similarly:
+
+        { double, double } sincos(double) -> npy_sincos(double, double *, double *)
+
+    Wrappers are named after the function they wrap, and reused by all
+    abstract math functions with the same signature. Returns the wrapper.
     """
-    if lfunc_dst.name.startswith('nc_'):
-        name = 'llvmmath.complexwrapper.%s' % (lfunc_src.name,)
-        lfunc_dst = complex_support.create_val2ref_wrapper(
-            lfunc_dst, name, lfunc_src.type.pointee)
-        assert (lfunc_dst.module is lfunc_src.module)
-        lfunc_dst.linkage = lc.LINKAGE_LINKONCE_ODR
+    split = callconv.has_split_result(signature_of(lfunc_src))
+    if lfunc_dst.name.startswith('nc_') or split:
+        name = 'llvmmath.complexwrapper.%s' % (lfunc_dst.name,)
+        func_ty = lfunc_src.type.pointee
+        wrapper = find_function(lfunc_src.module, name, func_ty)
+        if wrapper is None:
+            wrapper = create_wrapper(lfunc_dst, name, func_ty)
+            wrapper.linkage = lc.LINKAGE_LINKONCE_ODR
+        assert (wrapper.module is lfunc_src.module)
+        lfunc_dst = wrapper
     else:
         raise ValueError(
             "Incorrect signature for %s (got '%s', need '%s')" % (
                 lfunc_src.name, lfunc_dst.type, lfunc_src.type))
 
     lfunc_src._ptr.replaceAllUsesWith(lfunc_dst._ptr)
+    return lfunc_dst
 
-def link_complex_external(lfunc, module):
+def get_external_wrapper(module, func_ty, key):
+    """
+    Get a declaration of an external complex math function taking arguments
+    by reference, and a wrapper of type func_ty calling it. Both are named
+    after key, and created only once per module.
+
+    Returns (declaration, wrapper, created). If 'created' is false, the
+    declaration was created earlier and already has an address.
+    """
+    name = 'llvmmath.external.%s' % (key,)
+    wrapper_name = 'llvmmath.externalwrap.%s' % (key,)
+
+    wrapper = find_function(module, wrapper_name, func_ty)
+    if wrapper is not None:
+        return module.get_function_named(name), wrapper, False
+
+    sig = ltypes.Signature(func_ty.return_type, func_ty.args)
+    native_sig = callconv.convention_cbyref(sig)
+    reffty = lc.Type.function(native_sig.restype, native_sig.argtypes)
+    wrapped = module.add_function(reffty, name)
+
+    wrapper = create_wrapper(wrapped, wrapper_name, func_ty)
+    wrapper.linkage = lc.LINKAGE_LINKONCE_ODR
+    return wrapped, wrapper, True
+
+def link_complex_external(lfunc, module, ptr=None):
     """
     Link a complex math function called by value to an external implementation
-    taking arguments by reference. Returns a function declaration for the
-    external function, which needs an address assigned (add_global_mapping).
+    taking arguments by reference.
 
         complex sin(complex) -> complex wrapper_sin(complex)
 
@@ -91,36 +138,193 @@ def link_complex_external(lfunc, module):
             complex out; nc_sin(&arg, &out); return out;
         }
 
-    Returns nc_sin, which needs an external address.
+    Functions with a split result (e.g. sincos) are linked the same way.
+    If the address ptr of nc_sin is given, the wrapper is shared by all
+    functions linking to it in the module.
+
+    Returns (nc_sin, wrapper_sin, created). nc_sin needs an external address
+    (add_global_mapping) if 'created' is set.
     """
-    fty = lfunc.type.pointee
+    key = lfunc.name if ptr is None else '0x%x' % (ptr,)
+    wrapped, wrapper, created = get_external_wrapper(
+        module, lfunc.type.pointee, key)
+    lfunc._ptr.replaceAllUsesWith(wrapper._ptr)
+    return wrapped, wrapper, created
 
-    name = 'llvmmath.external.%s' % (lfunc.name,)
-    wrapper_name = 'llvmmath.externalwrap.%s' % (lfunc.name,)
+class SharedWrappers(object):
+    """
+    Wrappers for external complex math functions taking arguments by
+    reference, compiled once in a module of their own and shared by any
+    number of client modules. Client modules call the wrappers by address,
+    see ExternalLibraryLinker.
 
-    argtys = map(lc.Type.pointer, fty.args + [fty.return_type])
-    reffty = lc.Type.function(lc.Type.void(), argtys)
-    wrapped = module.add_function(reffty, name)
+    :param engine: execution engine to compile the wrappers with. A new
+                   engine is created if not given.
+    """
 
-    lfunc_wrapper = complex_support.create_val2ref_wrapper(
-        wrapped, wrapper_name, lfunc.type.pointee)
-    lfunc_wrapper.linkage = lc.LINKAGE_LINKONCE_ODR
+    def __init__(self, engine=None):
+        self.module = lc.Module.new('llvmmath.sharedwrappers')
+        if engine is None:
+            engine = le.ExecutionEngine.new(self.module)
+        else:
+            engine.add_module(self.module)
+        self.engine = engine
+        self.addresses = {} # (ptr, str(func_ty)) -> wrapper address
+
+    def get_address(self, func_ty, ptr):
+        """
+        Get the address of a wrapper of type func_ty, which passes arguments
+        by value, for the complex math function at address ptr
+        """
+        key = (ptr, str(func_ty))
+        if key not in self.addresses:
+            wrapped, wrapper, created = get_external_wrapper(
+                self.module, func_ty, '0x%x.%d' % (ptr, len(self.addresses)))
+            wrapper.linkage = lc.LINKAGE_EXTERNAL
+            self.engine.add_global_mapping(wrapped, ptr)
+            self.addresses[key] = self.engine.get_pointer_to_function(wrapper)
+        return self.addresses[key]
+
+def is_native_complex(library, lfunc):
+    """
+    Whether the library passes the complex numbers of by-value math function
+    lfunc in registers (see callconv.convention_cbyval).
+    """
+    return library.passes_complex_byval(signature_of(lfunc))
+
+def link_native_complex(lfunc_src, lfunc_dst):
+    """
+    Link a complex math function called by value to an implementation that
+    passes complex numbers following the native C ABI. The arguments and
+    results are converted at each call site, without a wrapper:
+
+        %r = call { float, float } @sin({ float, float } %x)
+
+    becomes
 
-    lfunc._ptr.replaceAllUsesWith(lfunc_wrapper._ptr)
-    return wrapped
+        %x.re = extractvalue { float, float } %x, 0
+        %x.im = extractvalue { float, float } %x, 1
+        %x.0 = insertelement <2 x float> undef, float %x.re, i32 0
+        %x.1 = insertelement <2 x float> %x.0, float %x.im, i32 1
+        %v = call <2 x float> @ncv_sinf(<2 x float> %x.1)
+        ...
+        %r = insertvalue { float, float } %r.0, float %r.im, 1
+
+    Returns lfunc_dst.
+    """
+    sig = signature_of(lfunc_src)
+    native_sig = callconv.convention_cbyval(sig)
+    if signature_of(lfunc_dst) != native_sig:
+        raise ValueError(
+            "Incorrect signature for %s (got '%s', need '%s')" % (
+                lfunc_src.name, lfunc_dst.type, native_sig))
+
+    for bb, calls in math_rewrites.find_calls(lfunc_src.module,
+                                              [lfunc_src.name]):
+        for i, callinst in calls:
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+            args = callinst.operands[:-1] # the callee is the last operand
+            result = complex_support.emit_native_call(
+                builder, lfunc_dst, args, sig.restype)
+            math_rewrites.replace_call(callinst, result)
+
+    return lfunc_dst
+
+#===------------------------------------------------------------------===
+# Function attributes
+#===------------------------------------------------------------------===
+
+def add_attributes(lfunc, attrs, math_errno=True):
+    """
+    Add LLVM function attributes for the attributes of a math function from
+    the symbol file (see parsesyms). Pure functions are marked readnone
+    unless they may set errno and math_errno is set.
+    """
+    if 'nounwind' in attrs:
+        lfunc.add_attribute(lc.ATTR_NO_UNWIND)
+    if 'pure' in attrs and ('noerrno' in attrs or not math_errno):
+        lfunc.add_attribute(lc.ATTR_READ_NONE)
+
+def function_size(lfunc):
+    "Count the instructions of a function"
+    return sum(len(bb.instructions) for bb in lfunc.basic_blocks)
+
+def add_inlining_hints(module, library, profile, hot_calls=1000,
+                       cold_calls=0, max_inline_size=200):
+    """
+    Mark the math functions of the library linked into module alwaysinline
+    if they were called at least hot_calls times in the profile and have at
+    most max_inline_size instructions. Functions called at most cold_calls
+    times are marked noinline and optsize. Functions missing from the
+    profile, e.g. helpers called by other math functions, are left alone.
+
+    :param profile: { (math_name, signature) : ProfileEntry(calls, cycles) }
+                    from profiling.CallProfiler.read()
+    """
+    for name, signatures in library.symbols.items():
+        for sig, lfunc_math in signatures.items():
+            if not complex_support.have_lfunc(module, lfunc_math.name):
+                continue
+            lfunc = module.get_function_named(lfunc_math.name)
+            if lfunc.is_declaration:
+                continue
+
+            entry = profile.get((name, sig))
+            if entry is None:
+                continue
+            calls = entry.calls
+            if calls >= hot_calls and function_size(lfunc) <= max_inline_size:
+                lfunc.add_attribute(lc.ATTR_ALWAYS_INLINE)
+            elif calls <= cold_calls:
+                lfunc.add_attribute(lc.ATTR_NO_INLINE)
+                lfunc.add_attribute(lc.ATTR_OPTIMIZE_FOR_SIZE)
 
 #===------------------------------------------------------------------===
 # Library linkers
 #===------------------------------------------------------------------===
 
 class Linker(object):
-    "Link math functions into a destination module"
+    """
+    Link math functions into a destination module.
+
+    :param math_errno: whether setting errno is an observable side effect of
+                       math functions. If not, all pure functions are marked
+                       readnone, like with -fno-math-errno.
+    :param fast_complex_division: whether to divide complex numbers by
+                                  multiplying with a reciprocal
+    :param incremental: whether modules are linked again after adding
+                        functions. Each call then links only the abstract
+                        math calls added since the last one.
+    :param intrinsics: whether to compute math functions with an LLVM
+                       intrinsic (e.g. fma or popcount) through the intrinsic
+    :param fp_contract: whether to contract multiplications and additions
+                        in the module's own functions to fused multiply-adds
+                        after linking. Linked math functions are left alone,
+                        their algorithms rely on separate rounding.
+    """
+
+    def __init__(self, math_errno=True, fast_complex_division=False,
+                 incremental=False, intrinsics=True, fp_contract=False):
+        self.math_errno = math_errno
+        self.fast_complex_division = fast_complex_division
+        self.incremental = incremental
+        # Linkage of the math functions linked into modules
+        if incremental:
+            self.math_linkage = lc.LINKAGE_INTERNAL
+        else:
+            self.math_linkage = lc.LINKAGE_LINKONCE_ODR
+        self.intrinsics = intrinsics
+        self.fp_contract = fp_contract
 
     def setup(self, engine, module, library):
         "Link math functions from the library into the destination module"
 
     def link(self, engine, module, library, lfunc_src, lfunc_dst):
-        "Replace unbound math function lfunc_src with math function lfunc_dst"
+        """
+        Replace unbound math function lfunc_src with math function lfunc_dst.
+        Returns the function now called instead of lfunc_src.
+        """
 
     def optimize(self, engine, module, library):
         "Optimize after linking (inlining, DCE, etc)"
@@ -129,50 +333,232 @@ class LLVMLinker(Linker):
     """
     Resolve abstract math calls to calls from mathcode.s and link mathcode.s
     into module.
+
+    :param profile: call counts from profiling.CallProfiler.read() to guide
+                    inlining of the math functions, see add_inlining_hints
     """
 
+    def __init__(self, profile=None, hot_calls=1000, cold_calls=0,
+                 max_inline_size=200, **kwds):
+        super(LLVMLinker, self).__init__(**kwds)
+        self.profile = profile
+        self.hot_calls = hot_calls
+        self.cold_calls = cold_calls
+        self.max_inline_size = max_inline_size
+
     def setup(self, engine, module, library):
-        module.link_in(library.module, preserve=True)
+        if not self.incremental:
+            link_in_math(module, library.module)
 
     def link(self, engine, module, library, lfunc_src, lfunc_dst):
         "Link the math to an LLVM math library"
-        lfunc_dst = module.get_function_named(lfunc_dst.name)
-        v = lfunc_src._ptr
-        if lfunc_src.type != lfunc_dst.type:
-            link_complex_llvm(lfunc_dst, lfunc_src)
-        else:
-            v.replaceAllUsesWith(lfunc_dst._ptr)
+        if self.incremental:
+            link_in_math(module, library.module, required=lfunc_dst.name)
+        return link_llvm_function(module, library, lfunc_src, lfunc_dst)
 
     def optimize(self, engine, module, library):
         "Try to eliminate unused functions"
-        for lfunc_math in library.module.functions:
-            lfunc = module.get_function_named(lfunc_math.name)
-            # Don't use 'lfunc.uses', it may break when we have a constant
-            # expression as user:  TypeError: Downcast from llvm::User to
-            # llvm::ConstantExpr is not supported
-            if not lfunc._ptr.list_use():
-                lfunc.delete()
-            elif not lfunc.is_declaration:
-                lfunc.linkage = lc.LINKAGE_LINKONCE_ODR
+        drop_unused_math(module, library.module, self.math_linkage)
+        if self.profile is not None:
+            add_inlining_hints(module, library, self.profile, self.hot_calls,
+                               self.cold_calls, self.max_inline_size)
+
+def link_llvm_function(module, library, lfunc_src, lfunc_dst):
+    """
+    Replace lfunc_src with the function named like lfunc_dst in module,
+    linked from the library.
+    """
+    lfunc_dst = module.get_function_named(lfunc_dst.name)
+    v = lfunc_src._ptr
+    if is_native_complex(library, lfunc_src):
+        return link_native_complex(lfunc_src, lfunc_dst)
+    elif lfunc_src.type != lfunc_dst.type:
+        return link_complex_llvm(lfunc_dst, lfunc_src)
+    else:
+        v.replaceAllUsesWith(lfunc_dst._ptr)
+        return lfunc_dst
+
+def is_defined(module, name):
+    "Whether module defines a function with the given name"
+    return (complex_support.have_lfunc(module, name) and
+            not module.get_function_named(name).is_declaration)
+
+def link_in_math(module, math_module, required=None):
+    """
+    Link math_module into module. When linking incrementally, pass the name
+    of the math function required: math_module is then only linked in if
+    module doesn't define it already, since earlier links dropped the
+    functions unused at the time (see drop_unused_math). The internal copies
+    kept from earlier links are renamed, not replaced.
+    """
+    if required is None or not is_defined(module, required):
+        module.link_in(math_module, preserve=True)
 
-        for global_val in library.module.global_variables:
+def drop_unused_math(module, math_module, linkage=lc.LINKAGE_LINKONCE_ODR):
+    """
+    Delete the functions of math_module that were linked into module but are
+    not used, and give the others the given linkage. Incremental linkers use
+    internal linkage, so linking math_module in again doesn't replace
+    functions the engine may have compiled already.
+    """
+    for lfunc_math in math_module.functions:
+        if not complex_support.have_lfunc(module, lfunc_math.name):
+            continue # dropped by an earlier incremental link
+        lfunc = module.get_function_named(lfunc_math.name)
+        # Don't use 'lfunc.uses', it may break when we have a constant
+        # expression as user:  TypeError: Downcast from llvm::User to
+        # llvm::ConstantExpr is not supported
+        if not lfunc._ptr.list_use():
+            lfunc.delete()
+        elif not lfunc.is_declaration:
+            lfunc.linkage = linkage
+
+    for global_val in math_module.global_variables:
+        if complex_support.have_global(module, global_val.name):
             gv = module.get_global_variable_named(global_val.name)
-            gv.linkage = lc.LINKAGE_LINKONCE_ODR
+            gv.linkage = linkage
 
-        # fpm = lp.PassManager.new()
-        # fpm.add(lp.PASS_GLOBALDCE)
-        # fpm.run(module)
-        return
+    # fpm = lp.PassManager.new()
+    # fpm.add(lp.PASS_GLOBALDCE)
+    # fpm.run(module)
 
 class ExternalLibraryLinker(Linker):
+    """
+    Resolve abstract math calls to functions in external code by address.
+
+    :param shared_wrappers: SharedWrappers to get by-reference complex
+                            wrappers from, instead of creating them in each
+                            module
+    """
+
+    def __init__(self, shared_wrappers=None, **kwds):
+        super(ExternalLibraryLinker, self).__init__(**kwds)
+        self.shared_wrappers = shared_wrappers
 
     def link(self, engine, module, library, lfunc, ptr):
         "Link the math by adding pointers to functions in external code"
-        is_complex = lfunc.args[0].type.kind == lc.TYPE_STRUCT
-        if is_complex:
-            lfunc = link_complex_external(lfunc, module)
+        fty = lfunc.type.pointee
+        is_byref = any(ty.kind == lc.TYPE_STRUCT
+                           for ty in [fty.return_type] + fty.args)
+        if is_native_complex(library, lfunc):
+            native_sig = library.calling_convention(signature_of(lfunc))
+            native_fty = lc.Type.function(native_sig.restype,
+                                          native_sig.argtypes)
+            name = 'llvmmath.external.0x%x' % (ptr,)
+            native = find_function(module, name, native_fty)
+            if native is None:
+                native = module.add_function(native_fty, name)
+                engine.add_global_mapping(native, ptr)
+            lfunc = link_native_complex(lfunc, native)
+        elif is_byref and self.shared_wrappers is not None:
+            engine.add_global_mapping(
+                lfunc, self.shared_wrappers.get_address(fty, ptr))
+        elif is_byref:
+            wrapped, lfunc, created = link_complex_external(lfunc, module, ptr)
+            if created:
+                engine.add_global_mapping(wrapped, ptr)
+        else:
+            engine.add_global_mapping(lfunc, ptr)
+
+        return lfunc
+
+def is_small_leaf(lfunc, max_size):
+    """
+    Whether lfunc is defined with at most max_size instructions, and only
+    calls declared functions (intrinsics or external code)
+    """
+    if lfunc.is_declaration:
+        return False
+
+    for bb in lfunc.basic_blocks:
+        for inst in bb.instructions:
+            if inst.opcode_name == 'call':
+                callee = inst.called_function
+                if callee is None or not callee.is_declaration:
+                    return False
+
+    return function_size(lfunc) <= max_size
 
-        engine.add_global_mapping(lfunc, ptr)
+def small_leaf_module(library_module, max_size):
+    """
+    Copy the library module, keeping only the definitions of small leaf
+    functions (see is_small_leaf). Returns None if there are none.
+    """
+    bitcode = io.BytesIO(library_module.to_bitcode())
+    module = lc.Module.from_bitcode(bitcode)
+    leaves = set(lfunc.name for lfunc in module.functions
+                     if is_small_leaf(lfunc, max_size))
+    if not leaves:
+        return None
+
+    # Other functions may call each other, delete until nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for lfunc in list(module.functions):
+            if lfunc.name not in leaves and not lfunc._ptr.list_use():
+                lfunc.delete()
+                changed = True
+
+    for gv in list(module.global_variables):
+        if not gv._ptr.list_use():
+            gv.delete()
+
+    return module
+
+class SharedLLVMLinker(ExternalLibraryLinker):
+    """
+    Resolve abstract math calls to the functions of an LLVM math library
+    compiled once in the library's execution engine, by address. Client
+    modules do not get a copy of the math code, except small leaf functions
+    if inline_size is given.
+
+    :param inline_size: link functions with at most this many instructions
+                        that call no other math functions into the client
+                        module, where they can be inlined
+    """
+
+    def __init__(self, inline_size=0, **kwds):
+        super(SharedLLVMLinker, self).__init__(**kwds)
+        self.inline_size = inline_size
+        self.inline_modules = {} # library -> module of small leaf functions
+
+    def get_inline_module(self, library):
+        if not self.inline_size:
+            return None
+        if library not in self.inline_modules:
+            self.inline_modules[library] = small_leaf_module(
+                library.module, self.inline_size)
+        return self.inline_modules[library]
+
+    def is_inlined(self, library, lfunc_dst):
+        inline_module = self.get_inline_module(library)
+        return (inline_module is not None and
+                complex_support.have_lfunc(inline_module, lfunc_dst.name) and
+                not inline_module.get_function_named(
+                    lfunc_dst.name).is_declaration)
+
+    def setup(self, engine, module, library):
+        inline_module = self.get_inline_module(library)
+        if inline_module is not None and not self.incremental:
+            link_in_math(module, inline_module)
+
+    def link(self, engine, module, library, lfunc_src, lfunc_dst):
+        "Link the math to a small function in module or by address"
+        if self.is_inlined(library, lfunc_dst):
+            if self.incremental:
+                link_in_math(module, self.get_inline_module(library),
+                             required=lfunc_dst.name)
+            return link_llvm_function(module, library, lfunc_src, lfunc_dst)
+
+        ptr = library.get_engine().get_pointer_to_function(lfunc_dst)
+        return super(SharedLLVMLinker, self).link(
+            engine, module, library, lfunc_src, ptr)
+
+    def optimize(self, engine, module, library):
+        inline_module = self.get_inline_module(library)
+        if inline_module is not None:
+            drop_unused_math(module, inline_module, self.math_linkage)
 
 #===------------------------------------------------------------------===
 # Linking
@@ -185,7 +571,8 @@ def get_linker(lib):
     else:
         return ExternalLibraryLinker()
 
-def link_llvm_math_intrinsics(engine, module, library, linker, replacements):
+def link_llvm_math_intrinsics(engine, module, library, linker, replacements,
+                              rewrites=()):
     """
     Link all abstract math calls by adding a runtime address or by replacing
     callsites with a different LLVM function.
@@ -197,23 +584,69 @@ def link_llvm_math_intrinsics(engine, module, library, linker, replacements):
     :type linker: ``llvmmath.linking.Linker``
     :param replacements: { abstract_math_name -> math_name }
     :type replacements: dict of str -> str
+    :param rewrites: rewrites of abstract math calls to run before linking,
+                     e.g. ``llvmmath.rewrites.fuse_sincos``
+    :type rewrites: sequence of callables (module, library, replacements)
+
+    If the linker is incremental, this can be called again after adding
+    functions to the module, linking only the abstract math calls that were
+    added.
+
+    This can be called from several threads. Linking mutates the global LLVM
+    context, so calls are serialized through llvm_support.context_lock.
+    """
+    with context_lock:
+        _link_llvm_math_intrinsics(engine, module, library, linker,
+                                   replacements, rewrites)
+
+def own_functions(module, library):
+    """
+    Get the functions defined in module that were not linked in from the
+    library. This includes the internal copies kept from earlier incremental
+    links, which LLVM renames by appending a number (npy_sin -> npy_sin1).
     """
+    if isinstance(library.module, lc.Module):
+        math_names = set(lfunc.name for lfunc in library.module.functions)
+    else:
+        math_names = set() # external code is called, not linked in
+
+    def is_math(name):
+        while name not in math_names and name[-1:].isdigit():
+            name = name[:-1]
+        return name in math_names
+
+    return [lfunc for lfunc in module.functions
+                if not lfunc.is_declaration and not is_math(lfunc.name)]
+
+def _link_llvm_math_intrinsics(engine, module, library, linker, replacements,
+                               rewrites):
+    if linker.fp_contract:
+        contract = own_functions(module, library)
+
+    # Rewrites may add abstract math functions
+    replacements = dict(replacements)
+    math_rewrites.inline_complex_arith(module, library, replacements,
+                                       linker.fast_complex_division)
+    math_rewrites.promote_half(module, library, replacements)
+    if linker.intrinsics:
+        math_rewrites.use_intrinsics(module, library, replacements)
+    for rewrite in rewrites:
+        rewrite(module, library, replacements)
+
     linker.setup(engine, module, library)
 
     # find all known math intrinsics and implement them.
-    for lfunc in module.functions:
+    for lfunc in list(module.functions):
         if lfunc.name in replacements:
             name = replacements[lfunc.name]
-            argtypes = lfunc.type.pointee.args
-            restype = lfunc.type.pointee.return_type
-
-            # Complex numbers are passed by reference
-            if restype.kind == lc.TYPE_VOID:
-                assert len(argtypes) == 2
-                restype = argtypes[1].pointee
-                argtypes = [argtypes[0].pointee]
-
-            sig = ltypes.Signature(restype, argtypes)
+            if linker.incremental:
+                if not lfunc._ptr.list_use():
+                    lfunc.delete() # declared again when used later
+                    continue
+                # Abstract functions declared later get a new declaration
+                abstract = lfunc
+                abstract.name = 'llvmmath.linked.%s' % (name,)
+            sig, byref = math_signature(lfunc)
             linkarg = library.get_symbol(name, sig)
 
             # See whether our symbol is available
@@ -222,7 +655,18 @@ def link_llvm_math_intrinsics(engine, module, library, linker, replacements):
                     "Symbol %s with signature %s not available, "
                     "we only have %s" % (name, sig, library.symbols[name]))
 
-            linker.link(engine, module, library, lfunc, linkarg)
+            linked = linker.link(engine, module, library, lfunc, linkarg)
             del lfunc # this is dead now, don't touch
 
+            attrs = library.get_attributes(name, sig)
+            if byref:
+                # The result is written to memory
+                attrs = [attr for attr in attrs if attr != 'pure']
+            add_attributes(linked, attrs, linker.math_errno)
+
+            if linker.incremental and not abstract._ptr.list_use():
+                abstract.delete()
+
     linker.optimize(engine, module, library)
+    if linker.fp_contract:
+        math_rewrites.contract_fma(module, contract)
@@ -13,6 +13,7 @@ import ctypes
 import io
 import os
 import sys
+import threading
 
 from llvm.core import Module
 import llvm.core
@@ -22,6 +23,12 @@ logger = logging.getLogger(__name__)
 
 PY3 = sys.version_info[0] >= 3
 
+# llvmpy creates all modules, types and constants in LLVM's global context,
+# which is not thread-safe. Anything that builds IR or generates code while
+# other threads may do the same must hold this lock, so such work is
+# serialized within a process.
+context_lock = threading.RLock()
+
 def map_llvm_to_ctypes(llvm_type, py_module=None):
     '''
     Map an LLVM type to an equivalent ctypes type. py_module is an
@@ -82,15 +82,24 @@ complexes = (l_complex64, l_complex128, l_complex256)
 
 all_types = integral + floating + complexes
 
+# Pairs of reals computed from real arguments, e.g. { sin(x), cos(x) }. They
+# have the same LLVM types as complex numbers (see callconv.has_split_result).
+pairs = complexes
+
 # ty = lambda name: mathcode_asm.get_global_variable_named(name).type
 # complexes = [ty('nc_if'), ty('nc_i'), ty('nc_il')]
 
 complexes_by_ref = [Type.pointer(ct) for ct in complexes]
 
+# Half precision floats are stored as 16-bit integers, like numpy's npy_half.
+# Math functions on halves compute in float (see rewrites.promote_half).
+l_half = Type.int(16)
+
 # ______________________________________________________________________
 
 float_kinds = (TYPE_FLOAT, TYPE_DOUBLE, TYPE_X86_FP80, TYPE_FP128, TYPE_PPC_FP128)
 is_float = lambda lty: lty.kind in float_kinds
+is_half = lambda lty: str(lty) == str(l_half)
 
 # ______________________________________________________________________
 
@@ -101,7 +110,7 @@ def strsig(restype, argtypes):
 Signature = collections.namedtuple('Signature', ['restype', 'argtypes'])
 Signature.__hash__ = lambda self: hash(strsig(*self))
 Signature.__eq__ = lambda self, other: strsig(*self) == strsig(*other)
-Signature.__neq__ = lambda self, other: strsig(*self) != strsig(*other)
+Signature.__ne__ = lambda self, other: strsig(*self) != strsig(*other)
 Signature.__repr__ = lambda self: str(strsig(*self))
 
 # ______________________________________________________________________
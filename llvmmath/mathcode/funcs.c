@@ -0,0 +1,7 @@
+/*
+ * Translation unit for funcs.inc, which is also included by mathcode.c.
+ * The build compiles each function family separately (see build.families).
+ */
+#include "export.h"
+
+#include "funcs.inc"
@@ -135,6 +135,12 @@ DL_EXPORT(double) npy_rint(double x);
 DL_EXPORT(double) npy_trunc(double x);
 DL_EXPORT(double) npy_exp2(double x);
 DL_EXPORT(double) npy_log2(double x);
+DL_EXPORT(double) npy_erf(double x);
+DL_EXPORT(double) npy_erfc(double x);
+DL_EXPORT(double) npy_lgamma(double x);
+DL_EXPORT(double) npy_tgamma(double x);
+DL_EXPORT(double) npy_cbrt(double x);
+DL_EXPORT(double) npy_exp10(double x);
 
 DL_EXPORT(double) npy_atan2(double x, double y);
 DL_EXPORT(double) npy_pow(double x, double y);
@@ -218,6 +224,12 @@ DL_EXPORT(float) npy_atanhf(float x);
 DL_EXPORT(float) npy_log1pf(float x);
 DL_EXPORT(float) npy_exp2f(float x);
 DL_EXPORT(float) npy_log2f(float x);
+DL_EXPORT(float) npy_erff(float x);
+DL_EXPORT(float) npy_erfcf(float x);
+DL_EXPORT(float) npy_lgammaf(float x);
+DL_EXPORT(float) npy_tgammaf(float x);
+DL_EXPORT(float) npy_cbrtf(float x);
+DL_EXPORT(float) npy_exp10f(float x);
 
 DL_EXPORT(float) npy_atan2f(float x, float y);
 DL_EXPORT(float) npy_hypotf(float x, float y);
@@ -259,6 +271,12 @@ DL_EXPORT(npy_longdouble) npy_atanhl(npy_longdouble x);
 DL_EXPORT(npy_longdouble) npy_log1pl(npy_longdouble x);
 DL_EXPORT(npy_longdouble) npy_exp2l(npy_longdouble x);
 DL_EXPORT(npy_longdouble) npy_log2l(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_erfl(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_erfcl(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_lgammal(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_tgammal(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_cbrtl(npy_longdouble x);
+DL_EXPORT(npy_longdouble) npy_exp10l(npy_longdouble x);
 
 DL_EXPORT(npy_longdouble) npy_atan2l(npy_longdouble x, npy_longdouble y);
 DL_EXPORT(npy_longdouble) npy_hypotl(npy_longdouble x, npy_longdouble y);
@@ -278,16 +296,31 @@ DL_EXPORT(double) npy_deg2rad(double x);
 DL_EXPORT(double) npy_rad2deg(double x);
 DL_EXPORT(double) npy_logaddexp(double x, double y);
 DL_EXPORT(double) npy_logaddexp2(double x, double y);
+DL_EXPORT(void) npy_sincos(double x, double *s, double *c);
+DL_EXPORT(double) npy_fma(double x, double y, double z);
 
 DL_EXPORT(float) npy_deg2radf(float x);
 DL_EXPORT(float) npy_rad2degf(float x);
 DL_EXPORT(float) npy_logaddexpf(float x, float y);
 DL_EXPORT(float) npy_logaddexp2f(float x, float y);
+DL_EXPORT(void) npy_sincosf(float x, float *s, float *c);
+DL_EXPORT(float) npy_fmaf(float x, float y, float z);
 
 DL_EXPORT(npy_longdouble) npy_deg2radl(npy_longdouble x);
 DL_EXPORT(npy_longdouble) npy_rad2degl(npy_longdouble x);
 DL_EXPORT(npy_longdouble) npy_logaddexpl(npy_longdouble x, npy_longdouble y);
 DL_EXPORT(npy_longdouble) npy_logaddexp2l(npy_longdouble x, npy_longdouble y);
+DL_EXPORT(void) npy_sincosl(npy_longdouble x, npy_longdouble *s, npy_longdouble *c);
+DL_EXPORT(npy_longdouble) npy_fmal(npy_longdouble x, npy_longdouble y, npy_longdouble z);
+
+/*
+ * Half precision (IEEE 754 binary16, stored as npy_half bits), computed by
+ * promotion to float (see npy_math_half.c.src)
+ */
+DL_EXPORT(float) npy_half_to_float(npy_half h);
+DL_EXPORT(npy_half) npy_float_to_half(float f);
+DL_EXPORT(void) npy_half_to_float_array(npy_intp n, const npy_half *x, float *r);
+DL_EXPORT(void) npy_float_to_half_array(npy_intp n, const float *x, npy_half *r);
 
 #define npy_degrees npy_rad2deg
 #define npy_degreesf npy_rad2degf
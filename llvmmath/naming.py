@@ -35,6 +35,8 @@ def mathname(name, signature):
     ltype = signature.argtypes[0]
     if name == 'abs':
         return absname(ltype)
+    elif ltype.kind == TYPE_INTEGER:
+        return int_name(name, ltype)
     elif ltypes.is_float(ltype):
         return float_name(name, ltype)
     else:
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of native code for JIT-compiled LLVM modules.
+
+Modules are compiled to a shared library keyed on a hash of their bitcode,
+the target triple, CPU, CPU features and optimization level. Later runs
+(in any process) load the shared library instead of generating code again.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import ctypes
+import hashlib
+import logging
+import tempfile
+from os.path import join, exists, expanduser
+
+from . import build
+from .aot import SharedLibraryEngine, pic_target_machine, emit_shared
+
+logger = logging.getLogger(__name__)
+
+# ______________________________________________________________________
+
+def default_cache_dir():
+    "Get the cache directory ($LLVMMATH_CACHE_DIR or ~/.cache/llvmmath)"
+    return os.environ.get('LLVMMATH_CACHE_DIR',
+                          join(expanduser('~'), '.cache', 'llvmmath'))
+
+#===------------------------------------------------------------------===
+# Engines
+#===------------------------------------------------------------------===
+
+class CachedEngine(SharedLibraryEngine):
+    """
+    Execution engine for a module that compiles it through an ObjectCache
+    when the first function pointer is requested. This can be created
+    before linking math into the module, but the module must not change
+    after the first function pointer was retrieved.
+    """
+
+    def __init__(self, module, cache):
+        self.module = module
+        self.cache = cache
+        self.dll = None
+
+    def get_pointer_to_function(self, lfunc):
+        if self.dll is None:
+            self.dll = self.cache.load(self.module)
+        return super(CachedEngine, self).get_pointer_to_function(lfunc)
+
+    def get_pointer_to_global(self, gv):
+        if self.dll is None:
+            self.dll = self.cache.load(self.module)
+        return super(CachedEngine, self).get_pointer_to_global(gv)
+
+#===------------------------------------------------------------------===
+# Object cache
+#===------------------------------------------------------------------===
+
+class ObjectCache(object):
+    """
+    Cache compiled LLVM modules as shared libraries in cache_dir.
+    """
+
+    def __init__(self, cache_dir=None, opt=2, cpu='', features=''):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.opt = opt
+        self.target_machine = pic_target_machine(opt, cpu, features)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, module):
+        "Compute the cache key for an LLVM module"
+        tm = self.target_machine
+        h = hashlib.sha1(module.to_bitcode())
+        for part in (tm.triple, tm.cpu, tm.feature_string, str(self.opt)):
+            h.update(b'\0' + part.encode('ascii'))
+        return h.hexdigest()
+
+    def filename(self, key):
+        return join(self.cache_dir, key + build.find_shared_ending())
+
+    def compile(self, module, outfile):
+        "Generate code for the module and link it to a shared library"
+        # Build in the cache directory so the final rename is atomic, other
+        # processes may be reading the cache
+        fd, tempfile_name = tempfile.mkstemp(dir=self.cache_dir)
+        os.close(fd)
+        try:
+            emit_shared(self.target_machine, module, tempfile_name,
+                        tempdir=self.cache_dir)
+            os.rename(tempfile_name, outfile)
+        finally:
+            if exists(tempfile_name):
+                os.remove(tempfile_name)
+
+    def load(self, module):
+        "Load the compiled module as a ctypes library, compiling if needed"
+        outfile = self.filename(self.key(module))
+        if exists(outfile):
+            self.hits += 1
+        else:
+            logger.debug("Object cache miss for module %s" % module.id)
+            self.misses += 1
+            if not exists(self.cache_dir):
+                try:
+                    os.makedirs(self.cache_dir)
+                except OSError:
+                    if not exists(self.cache_dir): # not created concurrently
+                        raise
+            self.compile(module, outfile)
+
+        return ctypes.CDLL(outfile)
+
+    def engine(self, module):
+        "Get an execution engine for the module backed by this cache"
+        return CachedEngine(module, self)
@@ -5,6 +5,17 @@ Parsing of symbol file the following format:
 
     float sin(float) # some comment
     complex pow(complex, complex)
+    float floor(float) [pure, nounwind, noerrno]
+    pair sincos(float)
+
+Types are int, float and complex, and pair for results made of two floats
+computed from real arguments, like { sin(x), cos(x) }. Functions may have
+optional function attributes in brackets:
+
+    pure:       the result depends only on the arguments, and the function
+                has no side effects other than possibly setting errno
+    nounwind:   the function does not unwind (throw exceptions)
+    noerrno:    the function does not set errno
 """
 
 from __future__ import print_function, division, absolute_import
@@ -14,9 +25,20 @@ import collections
 
 # TODO: Make Pymeta a dependency?
 
-Symbol = collections.namedtuple("Symbol", ['name', 'restype', 'argtypes'])
+class Symbol(collections.namedtuple("Symbol", ['name', 'restype', 'argtypes',
+                                               'attrs'])):
+    __slots__ = ()
+
+    def __new__(cls, name, restype, argtypes, attrs=()):
+        return super(Symbol, cls).__new__(cls, name, restype, argtypes,
+                                          tuple(attrs))
 
-pattern = r'(\w+)\s+(\w+)\((.*)\)' # float sin(...)
+attributes = ('pure', 'nounwind', 'noerrno')
+types = ('int', 'float', 'complex', 'pair')
+result_types = ('pair',) # only valid as result types
+
+pattern = r'(\w+)\s+(\w+)\(([^)]*)\)' # float sin(...)
+attrpattern = r'\s*\[([^]]*)\]'     # [pure, nounwind]
 comment = r'\s+#.*$'
 ident   = r'\w+'
 
@@ -31,9 +53,27 @@ def parse_symbols(file):
             restype, name, argtypes = m.groups()
             argtypes = [argty.strip() for argty in argtypes.split(",")]
             assert all(re.match(ident, argty) for argty in argtypes)
-            symbols.append(Symbol(name, restype, tuple(argtypes)))
+            for ty in [restype] + argtypes:
+                if ty not in types:
+                    raise ValueError("Unknown type %r for %s" % (ty, name))
+            for ty in argtypes:
+                if ty in result_types:
+                    raise ValueError("Type %r is only valid as the result "
+                                     "type, for %s" % (ty, name))
             line = line[len(m.group(0)):]
 
+            attrs = ()
+            m = re.match(attrpattern, line)
+            if m:
+                attrs = tuple(attr.strip() for attr in m.group(1).split(","))
+                for attr in attrs:
+                    if attr not in attributes:
+                        raise ValueError("Unknown attribute %r for %s" % (
+                                                                attr, name))
+                line = line[len(m.group(0)):]
+
+            symbols.append(Symbol(name, restype, tuple(argtypes), attrs))
+
         match_empty(line)
 
     return symbols
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profiling of math calls. A CallProfiler is a rewrite (see llvmmath.rewrites)
+that counts the calls to each abstract math function in a global array in
+the module, and optionally the cycles spent in them:
+
+    >>> profiler = profiling.CallProfiler(timers=True)
+    >>> linking.link_llvm_math_intrinsics(engine, module, lib, linker, repls,
+    ...                                   rewrites=[profiler])
+    >>> ...
+    >>> profiler.read(engine)
+    {('sin', (double, (double,))): ProfileEntry(calls=1000, cycles=52342)}
+
+A RangeProfiler records histograms of the arguments of real math calls. The
+resulting RangeProfile selects the calls to give guarded fast paths (see
+rewrites.guard_fast_paths) when linking later:
+
+    >>> profile = range_profiler.read(engine)
+    >>> profile.save('math.profile.json')
+    ...
+    >>> profile = profiling.RangeProfile.load('math.profile.json')
+    >>> linking.link_llvm_math_intrinsics(engine, module, lib, linker, repls,
+    ...                                   rewrites=[profile.rewrite])
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import json
+import ctypes
+import itertools
+import collections
+
+from . import rewrites, linking, ltypes
+
+import llvm.core as lc
+
+ProfileEntry = collections.namedtuple('ProfileEntry', ['calls', 'cycles'])
+
+# Global counter arrays are named uniquely in the process, modules may share
+# an engine
+_counter_ids = itertools.count()
+
+int32 = lc.Type.int(32)
+int64 = lc.Type.int(64)
+
+# ______________________________________________________________________
+
+def add_counters(module, name, size):
+    "Add a global array of 'size' 64-bit counters initialized to zero"
+    ty = lc.Type.array(int64, size)
+    gv = module.add_global_variable(ty, '%s.%d' % (name, next(_counter_ids)))
+    gv.initializer = lc.Constant.null(ty)
+    return gv
+
+def increment(builder, counters, index, value):
+    "Add value to counters[index]"
+    zero = lc.Constant.int(int32, 0)
+    ptr = builder.gep(counters, [zero, lc.Constant.int(int32, index)])
+    builder.store(builder.add(builder.load(ptr), value), ptr)
+
+def read_cycle_counter(builder):
+    module = builder.basic_block.function.module
+    readcyclecounter = module.get_or_insert_function(
+        lc.Type.function(int64, []), 'llvm.readcyclecounter')
+    return builder.call(readcyclecounter, [])
+
+def counters_of(engine, gv):
+    "Get the counters of global array gv as a ctypes array"
+    ctype = ctypes.c_uint64 * gv.type.pointee.count
+    return ctype.from_address(engine.get_pointer_to_global(gv))
+
+class CallProfiler(object):
+    """
+    Count calls to abstract math functions, per math function and signature.
+
+    :param timers: also count the cycles spent in the calls, using the
+                   processor's cycle counter (llvm.readcyclecounter)
+    """
+
+    def __init__(self, timers=False):
+        self.timers = timers
+        # [(keys, counts_gv, cycles_gv)], one for each instrumented module
+        self.instrumented = []
+
+    def __call__(self, module, library, replacements):
+        "Instrument all calls to abstract math functions in the module"
+        callsites = []
+        keys = []
+        indices = {} # (math_name, signature) -> counter index
+        for bb, calls in rewrites.math_calls(module, replacements,
+                                             set(replacements.values())):
+            instructions = bb.instructions
+            for i, callinst, name in calls:
+                sig, byref = linking.math_signature(callinst.called_function)
+                key = (name, sig)
+                if key not in indices:
+                    indices[key] = len(keys)
+                    keys.append(key)
+                callsites.append((callinst, instructions[i + 1], indices[key]))
+
+        if not callsites:
+            return
+
+        counts = add_counters(module, 'llvmmath.profile.calls', len(keys))
+        cycles = None
+        if self.timers:
+            cycles = add_counters(module, 'llvmmath.profile.cycles', len(keys))
+
+        builder = lc.Builder.new(callsites[0][0].basic_block)
+        for callinst, next_inst, index in callsites:
+            builder.position_before(callinst)
+            increment(builder, counts, index, lc.Constant.int(int64, 1))
+            if self.timers:
+                start = read_cycle_counter(builder)
+                builder.position_before(next_inst)
+                stop = read_cycle_counter(builder)
+                increment(builder, cycles, index, builder.sub(stop, start))
+
+        self.instrumented.append((keys, counts, cycles))
+
+    def read(self, engine):
+        """
+        Read the profile of the instrumented modules compiled by engine.
+        Returns { (math_name, signature) : ProfileEntry(calls, cycles) }.
+        Cycles are None if the profiler has no timers.
+        """
+        profile = {}
+        for keys, counts_gv, cycles_gv in self.instrumented:
+            counts = counters_of(engine, counts_gv)
+            cycles = None
+            if cycles_gv is not None:
+                cycles = counters_of(engine, cycles_gv)
+            for index, key in enumerate(keys):
+                ncalls, ncycles = profile.get(key, (0, 0))
+                ncalls += counts[index]
+                if cycles is None:
+                    ncycles = None
+                else:
+                    ncycles += cycles[index]
+                profile[key] = ProfileEntry(ncalls, ncycles)
+
+        return profile
+
+    def reset(self, engine):
+        "Reset all counters to zero"
+        for keys, counts_gv, cycles_gv in self.instrumented:
+            for gv in (counts_gv, cycles_gv):
+                if gv is not None:
+                    ctypes.memset(counters_of(engine, gv), 0,
+                                  8 * gv.type.pointee.count)
+
+#===------------------------------------------------------------------===
+# Argument ranges
+#===------------------------------------------------------------------===
+
+class RangeProfile(object):
+    """
+    Histograms of the arguments of math functions. Bin i of a histogram
+    counts the arguments in [boundaries[i - 1], boundaries[i]), from -inf to
+    inf, and the last bin counts NaNs.
+
+    :param histograms: { (math_name, strsig) : [histogram of each argument] }
+    """
+
+    def __init__(self, boundaries, histograms):
+        self.boundaries = tuple(boundaries)
+        self.histograms = histograms
+
+    def __getitem__(self, key):
+        "Get the histograms of the arguments for (math_name, signature)"
+        name, sig = key
+        return self.histograms[name, ltypes.strsig(*sig)]
+
+    def bins(self):
+        "Get the [lo, hi) ranges of the bins, except the NaN bin"
+        inf = float('inf')
+        bounds = (-inf,) + self.boundaries + (inf,)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def within(self, name, sig, domain):
+        """
+        Whether all recorded arguments of the function were in domain, a
+        rewrites.Domain. A bin counts as inside only if all of its range is,
+        so for an open domain (lo, hi) bins must start above lo. False if the
+        function was not called.
+        """
+        key = name, ltypes.strsig(*sig)
+        if key not in self.histograms:
+            return False
+
+        lo, hi, closed = domain
+        ncalls = 0
+        for histogram in self.histograms[key]:
+            if histogram[-1]: # NaNs
+                return False
+            for (start, stop), count in zip(self.bins(), histogram):
+                inside_lo = lo <= start if closed else lo < start
+                if count and not (inside_lo and start <= stop <= hi):
+                    return False
+                ncalls += count
+        return ncalls > 0
+
+    def select(self, name, sig):
+        "Whether to rewrite calls to the fast path of the function"
+        fast_path = rewrites.fast_paths.get(name)
+        return (fast_path is not None and
+                self.within(name, sig, fast_path.domain))
+
+    def rewrite(self, module, library, replacements):
+        "Rewrite calls to fast paths the profile selects"
+        rewrites.guard_fast_paths(module, library, replacements, self.select)
+
+    def save(self, filename):
+        "Save the profile as JSON"
+        functions = [{'name': name, 'restype': restype,
+                      'argtypes': list(argtypes), 'histograms': histograms}
+                         for (name, (restype, argtypes)), histograms
+                             in sorted(self.histograms.items())]
+        with open(filename, 'w') as f:
+            json.dump({'boundaries': list(self.boundaries),
+                       'functions': functions}, f, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        "Load a profile saved with save()"
+        with open(filename) as f:
+            data = json.load(f)
+
+        histograms = {}
+        for function in data['functions']:
+            key = (str(function['name']),
+                   (str(function['restype']),
+                    tuple(map(str, function['argtypes']))))
+            histograms[key] = function['histograms']
+        return cls(data['boundaries'], histograms)
+
+class RangeProfiler(object):
+    """
+    Record histograms of the arguments of calls to real math functions, in
+    global arrays in the module.
+
+    :param boundaries: increasing bin boundaries, see RangeProfile
+    """
+
+    # Bins within the domains of the fast paths in rewrites.fast_paths
+    boundaries = (-2.0 ** 31 + 1, -1.0, 0.0, 1.0, 2.0 ** 31)
+
+    def __init__(self, boundaries=None):
+        if boundaries is not None:
+            self.boundaries = tuple(boundaries)
+        self.nbins = len(self.boundaries) + 2 # and NaN
+        # [(keys, offsets, counts_gv)], one for each instrumented module
+        self.instrumented = []
+
+    def bin_index(self, builder, x):
+        "Emit the bin of x as an i32"
+        index = lc.Constant.int(int32, 0)
+        for boundary in self.boundaries:
+            ge = builder.fcmp(lc.FCMP_OGE, x, lc.Constant.real(x.type,
+                                                               boundary))
+            index = builder.add(index, builder.zext(ge, int32))
+
+        isnan = builder.fcmp(lc.FCMP_UNO, x, x)
+        return builder.select(isnan, lc.Constant.int(int32, self.nbins - 1),
+                              index)
+
+    def __call__(self, module, library, replacements):
+        "Instrument all calls to real math functions in the module"
+        callsites = []
+        keys = []
+        offsets = {} # (math_name, signature) -> index of first counter
+        ncounters = 0
+        for bb, calls in rewrites.math_calls(module, replacements,
+                                             set(replacements.values())):
+            for i, callinst, name in calls:
+                args = callinst.operands[:-1] # the callee is the last operand
+                if not args or not all(ltypes.is_float(arg.type)
+                                           for arg in args):
+                    continue
+
+                sig = linking.math_signature(callinst.called_function)[0]
+                key = (name, sig)
+                if key not in offsets:
+                    offsets[key] = ncounters
+                    ncounters += len(args) * self.nbins
+                    keys.append(key)
+                callsites.append((callinst, args, offsets[key]))
+
+        if not callsites:
+            return
+
+        counts = add_counters(module, 'llvmmath.profile.ranges', ncounters)
+        zero = lc.Constant.int(int32, 0)
+        one = lc.Constant.int(int64, 1)
+
+        builder = lc.Builder.new(callsites[0][0].basic_block)
+        for callinst, args, offset in callsites:
+            builder.position_before(callinst)
+            for argno, arg in enumerate(args):
+                first = lc.Constant.int(int32, offset + argno * self.nbins)
+                index = builder.add(first, self.bin_index(builder, arg))
+                ptr = builder.gep(counts, [zero, index])
+                builder.store(builder.add(builder.load(ptr), one), ptr)
+
+        self.instrumented.append((keys, offsets, counts))
+
+    def read(self, engine):
+        "Read the histograms of the instrumented modules as a RangeProfile"
+        histograms = {}
+        for keys, offsets, counts_gv in self.instrumented:
+            counts = counters_of(engine, counts_gv)
+            for name, sig in keys:
+                offset = offsets[name, sig]
+                nargs = len(sig.argtypes)
+                key = name, ltypes.strsig(*sig)
+                previous = histograms.get(key, [[0] * self.nbins] * nargs)
+                histograms[key] = [
+                    [total + counts[offset + argno * self.nbins + i]
+                         for i, total in enumerate(previous[argno])]
+                             for argno in range(nargs)]
+
+        return RangeProfile(self.boundaries, histograms)
+
+    def reset(self, engine):
+        "Reset all histograms to zero"
+        for keys, offsets, counts_gv in self.instrumented:
+            ctypes.memset(counters_of(engine, counts_gv), 0,
+                          8 * counts_gv.type.pointee.count)
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rewrites of abstract math calls before linking. A rewrite is a callable
+taking (module, library, replacements), which may rewrite calls to abstract
+math functions and add new abstract math functions to replacements:
+
+    >>> linking.link_llvm_math_intrinsics(engine, module, lib, linker, repls,
+    ...                                   rewrites=[rewrites.fuse_sincos])
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import math
+import struct
+import ctypes
+import binascii
+import collections
+
+from . import ltypes, callconv
+from .complex_support import ComplexBuilder, complex_constant, have_lfunc
+
+import llvm.core as lc
+
+# ______________________________________________________________________
+
+def find_calls(module, callee_names):
+    """
+    Find calls to the functions with the given names. Yields
+    (basic_block, [(index, callinst)]) for each basic block with such calls,
+    in instruction order.
+    """
+    for lfunc in module.functions:
+        if lfunc.is_declaration:
+            continue
+        for bb in lfunc.basic_blocks:
+            calls = []
+            for i, inst in enumerate(bb.instructions):
+                if inst.opcode_name != 'call':
+                    continue
+                callee = inst.called_function
+                if callee is not None and callee.name in callee_names:
+                    calls.append((i, inst))
+            if calls:
+                yield bb, calls
+
+def math_calls(module, replacements, names):
+    """
+    Find calls to abstract math functions with the given math names. Yields
+    (basic_block, [(index, callinst, math_name)]) for each basic block with
+    such calls, in instruction order.
+    """
+    abstract_names = set(absname for absname, name in replacements.items()
+                                     if name in names)
+    for bb, calls in find_calls(module, abstract_names):
+        yield bb, [(i, callinst, replacements[callinst.called_function.name])
+                       for i, callinst in calls]
+
+def replace_call(callinst, value):
+    "Replace the result of a call with another value and delete the call"
+    callinst._ptr.replaceAllUsesWith(value._ptr)
+    callinst._ptr.eraseFromParent()
+
+def declare_math(module, library, replacements, name, restype, argtypes):
+    """
+    Declare an abstract math function llvmmath.<name>.<argtypes> for math
+    function 'name', or return None if the library doesn't have it.
+    """
+    if library.get_symbol(name, ltypes.Signature(restype, argtypes)) is None:
+        return None
+
+    absname = 'llvmmath.%s.%s' % (name, '.'.join(map(str, argtypes)))
+    replacements[absname] = name
+    fty = lc.Type.function(restype, argtypes)
+    return module.get_or_insert_function(fty, absname)
+
+def constant_float(value):
+    """
+    Get the value of a float or double constant as a Python float, or None
+    if value is not such a constant.
+    """
+    if (not isinstance(value, lc.ConstantFP) or
+            value.type.kind not in (lc.TYPE_FLOAT, lc.TYPE_DOUBLE)):
+        return None
+
+    # 'double 2.000000e+00', or the bits as a double for inexact decimals,
+    # e.g. 'float 0x3FB99999A0000000'
+    text = str(value).split()[-1]
+    if text.startswith('0x'):
+        return struct.unpack('>d', binascii.unhexlify(text[2:]))[0]
+    return float(text)
+
+def constant_complex(value):
+    "Get the value of a complex constant as a Python complex, or None"
+    if value.type.kind != lc.TYPE_STRUCT or not isinstance(value, lc.Constant):
+        return None
+    elif str(value).endswith('zeroinitializer'):
+        return 0j
+    elif isinstance(value, lc.ConstantStruct):
+        real, imag = map(constant_float, value.operands)
+        if real is not None and imag is not None:
+            return complex(real, imag)
+    return None
+
+#===------------------------------------------------------------------===
+# sin/cos fusion
+#===------------------------------------------------------------------===
+
+def fuse_sincos(module, library, replacements):
+    """
+    Fuse sin(x) and cos(x) of the same real x in a basic block into a single
+    sincos(x) call, which shares the argument reduction:
+
+        %s = call double @my.sin(double %x)
+        %c = call double @my.cos(double %x)
+
+    becomes
+
+        %sc = call { double, double } @llvmmath.sincos.double(double %x)
+        %s = extractvalue { double, double } %sc, 0
+        %c = extractvalue { double, double } %sc, 1
+    """
+    for bb, calls in math_calls(module, replacements, ('sin', 'cos')):
+        # { x : { 'sin' : [(index, callinst)], 'cos' : [...] } }
+        byarg = collections.defaultdict(lambda: collections.defaultdict(list))
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            if len(args) == 1 and ltypes.is_float(args[0].type):
+                byarg[args[0]][name].append((i, callinst))
+
+        for arg, bynames in byarg.items():
+            if not (bynames['sin'] and bynames['cos']):
+                continue
+
+            restype = lc.Type.struct([arg.type, arg.type])
+            sincos = declare_math(module, library, replacements, 'sincos',
+                                  restype, [arg.type])
+            if sincos is None:
+                continue
+
+            first = min(bynames['sin'] + bynames['cos'])[1]
+            builder = lc.Builder.new(bb)
+            builder.position_before(first)
+            result = builder.call(sincos, [arg])
+
+            for field, name in enumerate(('sin', 'cos')):
+                value = builder.extract_value(result, field)
+                for i, callinst in bynames[name]:
+                    replace_call(callinst, value)
+
+#===------------------------------------------------------------------===
+# pow strength reduction
+#===------------------------------------------------------------------===
+
+# Largest integer exponent to expand in relaxed mode
+max_pow_exponent = 64
+
+def power_by_squaring(mul, x, n):
+    "Compute x ** n for n >= 1 with mul(a, b)"
+    result = None
+    while True:
+        if n & 1:
+            result = x if result is None else mul(result, x)
+        n >>= 1
+        if not n:
+            return result
+        x = mul(x, x)
+
+def real_pow(builder, x, y, relaxed, declare_sqrt):
+    """
+    Emit pow(x, y) for a constant y. Returns the result or None if the call
+    should be kept.
+    """
+    one = lc.Constant.real(x.type, 1.0)
+    if y == 0:
+        return one
+    elif y == 1:
+        return x
+    elif y == 2:
+        return builder.fmul(x, x)
+    elif y == -1:
+        return builder.fdiv(one, x)
+    elif not relaxed:
+        return None
+
+    if abs(y) == 0.5:
+        # pow(-0.0, 0.5) is 0.0 and pow(-inf, 0.5) is inf, but sqrt gives
+        # -0.0 and nan
+        sqrt = declare_sqrt()
+        if sqrt is None:
+            return None
+        result = builder.call(sqrt, [x])
+    elif abs(y) <= max_pow_exponent and y == int(y):
+        # Rounds after every multiplication
+        result = power_by_squaring(builder.fmul, x, int(abs(y)))
+    else:
+        return None
+
+    if y < 0:
+        result = builder.fdiv(one, result)
+    return result
+
+def complex_pow(builder, a, y, relaxed):
+    """
+    Emit pow(a, y) for a constant y. This computes what nc_pow computes for
+    integer exponents, except that relaxed mode doesn't special-case a == 0.
+    Returns the result or None if the call should be kept.
+    """
+    cb = ComplexBuilder(builder, a.type)
+    if y == 0:
+        return cb.constant(1)
+    elif y.imag != 0 or not -100 < y.real < 100 or y.real != int(y.real):
+        return None
+
+    n = int(y.real)
+    if n == 1:
+        result = a
+    elif n == 2:
+        result = cb.prod(a, a)
+    elif n == 3:
+        result = cb.prod(a, cb.prod(a, a))
+    else:
+        # Same sequence of products as nc_pow
+        one = cb.constant(1)
+        aa, p, mask = one, a, 1
+        while True:
+            if abs(n) & mask:
+                aa = cb.prod(aa, p)
+            mask <<= 1
+            if abs(n) < mask:
+                break
+            p = cb.prod(p, p)
+        result = aa
+        if n < 0:
+            result = cb.quot(one, result)
+
+    if not relaxed:
+        # Complex zeros to a positive power are zero, otherwise nan
+        zero_result = cb.constant(0 if n > 0 else complex('nan+nanj'))
+        result = builder.select(cb.is_zero(a), zero_result, result)
+    return result
+
+def reduce_pow(module, library, replacements, relaxed=False):
+    """
+    Rewrite pow(x, y) with a constant exponent y to multiplications. Only
+    exact rewrites are done by default:
+
+        pow(x, 0) -> 1, pow(x, 1) -> x, pow(x, 2) -> x * x, pow(x, -1) -> 1 / x
+
+    and for complex pow the integer exponents nc_pow special-cases. With
+    'relaxed', pow(x, +-0.5) becomes (1 /) sqrt(x), and integer exponents
+    become products by squaring, which are less accurate. Use
+    functools.partial(reduce_pow, relaxed=True) as a rewrite.
+
+    Calls with arguments passed by reference are not rewritten.
+    """
+    for bb, calls in math_calls(module, replacements, ('pow',)):
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            if len(args) != 2 or str(callinst.type) != str(args[0].type):
+                continue
+
+            x, y = args
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+
+            result = None
+            if ltypes.is_float(x.type):
+                y = constant_float(y)
+                declare_sqrt = lambda: declare_math(
+                    module, library, replacements, 'sqrt', x.type, [x.type])
+                if y is not None:
+                    result = real_pow(builder, x, y, relaxed, declare_sqrt)
+            elif x.type.kind == lc.TYPE_STRUCT:
+                y = constant_complex(y)
+                if y is not None:
+                    result = complex_pow(builder, x, y, relaxed)
+
+            if result is not None:
+                replace_call(callinst, result)
+
+#===------------------------------------------------------------------===
+# Constant folding
+#===------------------------------------------------------------------===
+
+def is_foldable_type(ty):
+    "Whether we can represent values of type ty exactly in Python"
+    if ty.kind == lc.TYPE_STRUCT:
+        return all(map(is_foldable_type, ty.elements))
+    return ty.kind in (lc.TYPE_INTEGER, lc.TYPE_FLOAT, lc.TYPE_DOUBLE)
+
+def constant_value(value):
+    "Get the value of an integer, real or complex constant, or None"
+    if isinstance(value, lc.ConstantInt):
+        return value.s_ext_value
+    elif value.type.kind == lc.TYPE_STRUCT:
+        return constant_complex(value)
+    else:
+        return constant_float(value)
+
+def make_constant(ty, value):
+    "Create an LLVM constant of type ty from a Python number"
+    if ty.kind == lc.TYPE_INTEGER:
+        return lc.Constant.int(ty, value)
+    elif ty.kind == lc.TYPE_STRUCT:
+        return complex_constant(ty, value)
+    else:
+        return lc.Constant.real(ty, value)
+
+def is_finite(value):
+    return not any(math.isinf(x) or math.isnan(x)
+                       for x in (value.real, value.imag))
+
+def evaluate(library, name, sig, args):
+    "Call math function 'name' from the library with Python numbers"
+    func = library.get_ctypes_symbol(name, sig)
+
+    cargs = []
+    for i, (ty, arg) in enumerate(zip(sig.argtypes, args)):
+        if ty.kind == lc.TYPE_STRUCT:
+            cty = func.argtypes[i]
+            if issubclass(cty, ctypes.Structure):
+                arg = cty(arg.real, arg.imag) # by value
+            else:
+                arg = ctypes.pointer(cty._type_(arg.real, arg.imag))
+        cargs.append(arg)
+
+    if sig.restype.kind != lc.TYPE_STRUCT:
+        return func(*cargs)
+    elif func.restype is not None:
+        result = func(*cargs) # by value
+        return complex(result.e0, result.e1)
+
+    # Complex results are returned through the trailing pointer arguments
+    outs = [ptrty._type_() for ptrty in func.argtypes[len(cargs):]]
+    func(*(cargs + [ctypes.pointer(out) for out in outs]))
+    if callconv.has_split_result(sig):
+        real, imag = outs
+        return complex(real.value, imag.value)
+    else:
+        out, = outs
+        return complex(out.e0, out.e1)
+
+def fold_constants(module, library, replacements):
+    """
+    Evaluate calls of pure math functions with constant arguments at link
+    time, by calling the function from the library. The folded results are
+    therefore what the calls would compute at runtime.
+
+    Calls with a result that is not finite for finite arguments are kept,
+    since they may set errno. Calls taking or returning long doubles are
+    kept, since Python can't represent them.
+    """
+    names = set(replacements.values())
+    for bb, calls in math_calls(module, replacements, names):
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            argtypes = [arg.type for arg in args]
+            sig = ltypes.Signature(callinst.type, argtypes)
+            if ('pure' not in library.get_attributes(name, sig) or
+                    not all(map(is_foldable_type, [sig.restype] + argtypes))):
+                continue
+
+            values = [constant_value(arg) for arg in args]
+            if any(value is None for value in values):
+                continue
+
+            result = evaluate(library, name, sig, values)
+            if is_finite(result) or not all(map(is_finite, values)):
+                replace_call(callinst, make_constant(sig.restype, result))
+
+#===------------------------------------------------------------------===
+# Complex arithmetic
+#===------------------------------------------------------------------===
+
+complex_arith = ('neg', 'sum', 'diff', 'prod', 'quot')
+
+def inline_complex_arith(module, library, replacements, fast_division=False):
+    """
+    Replace calls of complex arithmetic (neg, sum, diff, prod, quot) on
+    complex values by the instructions computing them, so the values stay
+    in registers. The results are what nc_neg, nc_sum, etc compute. With
+    'fast_division', quot multiplies by a reciprocal instead of dividing.
+
+    link_llvm_math_intrinsics always runs this rewrite.
+    """
+    for bb, calls in math_calls(module, replacements, complex_arith):
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            if callinst.type.kind != lc.TYPE_STRUCT:
+                continue # passed by reference
+
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+            cb = ComplexBuilder(builder, callinst.type)
+            if name == 'quot':
+                result = cb.quot(args[0], args[1], fast=fast_division)
+            else:
+                result = getattr(cb, name)(*args)
+
+            replace_call(callinst, result)
+
+#===------------------------------------------------------------------===
+# LLVM intrinsics
+#===------------------------------------------------------------------===
+
+intrinsic_suffixes = { lc.TYPE_FLOAT: 'f32', lc.TYPE_DOUBLE: 'f64' }
+
+# Math functions computed by an LLVM intrinsic for float and double,
+# { math_name : intrinsic }. LLVM emits an instruction where the target has
+# one, and a libm call otherwise.
+intrinsics = {
+    'fma': 'fma',
+}
+
+def call_intrinsic(builder, name, *args):
+    "Call the LLVM intrinsic llvm.<name>.<f32|f64> on args of the same type"
+    ty = args[0].type
+    module = builder.basic_block.function.module
+    fty = lc.Type.function(ty, [ty] * len(args))
+    suffix = intrinsic_suffixes[ty.kind]
+    intrinsic = module.get_or_insert_function(fty, 'llvm.%s.%s' % (name,
+                                                                   suffix))
+    return builder.call(intrinsic, list(args))
+
+def call_int_intrinsic(builder, name, restype, *args):
+    "Call the LLVM intrinsic llvm.<name>.i<N> for the integer type of args[0]"
+    module = builder.basic_block.function.module
+    fty = lc.Type.function(restype, [arg.type for arg in args])
+    intrinsic = module.get_or_insert_function(
+        fty, 'llvm.%s.i%d' % (name, args[0].type.width))
+    return builder.call(intrinsic, list(args))
+
+def count_bits(name):
+    "Emit llvm.<ctlz|cttz>, which counts all bits for zero"
+    def emit(builder, x):
+        is_zero_undef = lc.Constant.int(lc.Type.int(1), 0)
+        return call_int_intrinsic(builder, name, x.type, x, is_zero_undef)
+    return emit
+
+def saturating(op):
+    """
+    Emit x <op> y with llvm.s<op>.with.overflow, saturated to the minimum or
+    maximum of the integer type on overflow. Both add and sub can only
+    overflow towards the sign of x.
+    """
+    def emit(builder, x, y):
+        ty = x.type
+        restype = lc.Type.struct([ty, lc.Type.int(1)])
+        result = call_int_intrinsic(builder, 's%s.with.overflow' % op,
+                                    restype, x, y)
+        minimum = lc.Constant.int_signextend(ty, -(1 << (ty.width - 1)))
+        maximum = lc.Constant.int(ty, (1 << (ty.width - 1)) - 1)
+        is_negative = builder.icmp(lc.ICMP_SLT, x, lc.Constant.null(ty))
+        return builder.select(builder.extract_value(result, 1),
+                              builder.select(is_negative, minimum, maximum),
+                              builder.extract_value(result, 0))
+    return emit
+
+# Integer math functions computed by LLVM intrinsics, { math_name : emit },
+# where emit(builder, *args) emits the result
+int_intrinsics = {
+    'popcount': lambda b, x: call_int_intrinsic(b, 'ctpop', x.type, x),
+    'clz': count_bits('ctlz'),
+    'ctz': count_bits('cttz'),
+    'bswap': lambda b, x: call_int_intrinsic(b, 'bswap', x.type, x),
+    'sat_add': saturating('add'),
+    'sat_sub': saturating('sub'),
+}
+
+def intrinsic_emitter(name, ty):
+    """
+    Get emit(builder, *args) computing math function 'name' on type ty with
+    an LLVM intrinsic, or None
+    """
+    if ty.kind in intrinsic_suffixes and name in intrinsics:
+        intrinsic = intrinsics[name]
+        return lambda builder, *args: call_intrinsic(builder, intrinsic, *args)
+    elif ty.kind == lc.TYPE_INTEGER and name in int_intrinsics:
+        return int_intrinsics[name]
+    return None
+
+def use_intrinsics(module, library, replacements):
+    """
+    Replace calls of math functions with an LLVM intrinsic (see intrinsics)
+    on float and double by calls to the intrinsic, and likewise for integer
+    functions (see int_intrinsics), e.g.
+
+        fma(x, y, z) -> llvm.fma.f64(x, y, z)
+        popcount(x) -> llvm.ctpop.i32(x)
+        sat_add(x, y) -> llvm.sadd.with.overflow.i32(x, y), saturated
+    """
+    names = set(intrinsics) | set(int_intrinsics)
+    for bb, calls in math_calls(module, replacements, names):
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            ty = callinst.type
+            if not all(str(arg.type) == str(ty) for arg in args):
+                continue
+
+            emit = intrinsic_emitter(name, ty)
+            if emit is None:
+                continue
+
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+            replace_call(callinst, emit(builder, *args))
+
+def contract_fma(module, functions=None):
+    """
+    Contract floating point multiplications and additions a * b + c in the
+    given functions (all functions of the module by default) to fused
+    multiply-adds llvm.fma(a, b, c), where the product is not used otherwise.
+    This rounds once instead of twice, and changes results like
+    -ffp-contract=fast.
+    """
+    if functions is None:
+        functions = module.functions
+
+    for lfunc in functions:
+        if lfunc.is_declaration:
+            continue
+
+        for bb in lfunc.basic_blocks:
+            for inst in list(bb.instructions):
+                if inst.opcode_name != 'fadd':
+                    continue
+                if inst.type.kind not in intrinsic_suffixes:
+                    continue # vectors
+
+                for mul, addend in (inst.operands, inst.operands[::-1]):
+                    if (isinstance(mul, lc.Instruction) and
+                            mul.opcode_name == 'fmul' and
+                            len(mul._ptr.list_use()) == 1):
+                        break
+                else:
+                    continue
+
+                builder = lc.Builder.new(bb)
+                builder.position_before(inst)
+                a, b = mul.operands
+                replace_call(inst, call_intrinsic(builder, 'fma', a, b,
+                                                  addend))
+                mul._ptr.eraseFromParent()
+
+#===------------------------------------------------------------------===
+# Guarded fast paths
+#===------------------------------------------------------------------===
+
+# Fast path of a math function, with the Domain of arguments it handles.
+# guard(builder, x) emits whether x is handled, fast(builder, x) the result.
+FastPath = collections.namedtuple('FastPath', ['domain', 'guard', 'fast'])
+
+# Range of arguments lo < x < hi, or lo <= x <= hi if closed
+Domain = collections.namedtuple('Domain', ['lo', 'hi', 'closed'])
+
+
+def copysign(builder, x, y):
+    "Get x with the sign of y"
+    bits = {lc.TYPE_FLOAT: 32, lc.TYPE_DOUBLE: 64}[x.type.kind]
+    ity = lc.Type.int(bits)
+    signbit = lc.Constant.int(ity, 1 << (bits - 1))
+    magnitude = lc.Constant.int(ity, (1 << (bits - 1)) - 1)
+    xbits = builder.and_(builder.bitcast(x, ity), magnitude)
+    ybits = builder.and_(builder.bitcast(y, ity), signbit)
+    return builder.bitcast(builder.or_(xbits, ybits), x.type)
+
+# Bound below which doubles are converted to 32-bit integers exactly
+max_int_conversion = 2.0 ** 31
+
+def guard_int_range(builder, x):
+    "-2**31 < x < 2**31, false for nan"
+    lower = builder.fcmp(lc.FCMP_OGT, x,
+                         lc.Constant.real(x.type, -max_int_conversion))
+    upper = builder.fcmp(lc.FCMP_OLT, x,
+                         lc.Constant.real(x.type, max_int_conversion))
+    return builder.and_(lower, upper)
+
+def int_round(adjust):
+    """
+    Round x by converting to an integer (truncating), compare the result to
+    x with adjust(builder, x, truncated) and copy the sign of x, so that e.g.
+    ceil(-0.5) is -0.0.
+    """
+    def fast(builder, x):
+        int32 = lc.Type.int(32)
+        truncated = builder.sitofp(builder.fptosi(x, int32), x.type)
+        return copysign(builder, adjust(builder, x, truncated), x)
+    return fast
+
+def adjust_floor(builder, x, t):
+    one = lc.Constant.real(x.type, 1.0)
+    return builder.select(builder.fcmp(lc.FCMP_OLT, x, t),
+                          builder.fsub(t, one), t)
+
+def adjust_ceil(builder, x, t):
+    one = lc.Constant.real(x.type, 1.0)
+    return builder.select(builder.fcmp(lc.FCMP_OGT, x, t),
+                          builder.fadd(t, one), t)
+
+int_domain = Domain(-max_int_conversion, max_int_conversion, closed=False)
+
+fast_paths = {
+    'sqrt': FastPath(
+        domain=Domain(0.0, float('inf'), closed=True),
+        guard=lambda b, x: b.fcmp(lc.FCMP_OGE, x,
+                                  lc.Constant.real(x.type, 0.0)),
+        fast=lambda b, x: call_intrinsic(b, 'sqrt', x)),
+    'trunc': FastPath(int_domain, guard_int_range,
+                      int_round(lambda b, x, t: t)),
+    'floor': FastPath(int_domain, guard_int_range, int_round(adjust_floor)),
+    'ceil': FastPath(int_domain, guard_int_range, int_round(adjust_ceil)),
+}
+
+def guarded_function(module, abstract, fast_path):
+    """
+    Get a function that computes fast_path for arguments it handles, and
+    calls the abstract math function otherwise.
+    """
+    name = 'llvmmath.guarded.%s' % (abstract.name,)
+    if have_lfunc(module, name):
+        return module.get_function_named(name)
+
+    lfunc = module.add_function(abstract.type.pointee, name)
+    lfunc.linkage = lc.LINKAGE_INTERNAL
+    x, = lfunc.args
+
+    builder = lc.Builder.new(lfunc.append_basic_block('entry'))
+    fast_bb = lfunc.append_basic_block('fast')
+    slow_bb = lfunc.append_basic_block('slow')
+    builder.cbranch(fast_path.guard(builder, x), fast_bb, slow_bb)
+
+    builder.position_at_end(fast_bb)
+    builder.ret(fast_path.fast(builder, x))
+
+    builder.position_at_end(slow_bb)
+    builder.ret(builder.call(abstract, [x]))
+    return lfunc
+
+def guard_fast_paths(module, library, replacements, select=None):
+    """
+    Call fast paths (see fast_paths) for the arguments they handle, and the
+    math functions otherwise:
+
+        sqrt(x) -> x >= 0 ? llvm.sqrt(x) : sqrt(x)
+        floor(x) -> |x| < 2**31 ? copysign(floor((int) x), x) : floor(x)
+
+    and likewise for ceil and trunc. This pays off when arguments are in the
+    fast path's domain, select(name, signature) decides which calls to
+    rewrite (all by default), e.g. RangeProfile.select from
+    llvmmath.profiling.
+    """
+    # The guarded functions call the math functions, find calls up front
+    for bb, calls in list(math_calls(module, replacements, fast_paths)):
+        for i, callinst, name in calls:
+            args = callinst.operands[:-1] # the callee is the last operand
+            ty = callinst.type
+            if (len(args) != 1 or ty.kind not in intrinsic_suffixes or
+                    str(args[0].type) != str(ty)):
+                continue
+
+            sig = ltypes.Signature(ty, [ty])
+            if select is not None and not select(name, sig):
+                continue
+
+            guarded = guarded_function(module, callinst.called_function,
+                                       fast_paths[name])
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+            replace_call(callinst, builder.call(guarded, args))
+
+#===------------------------------------------------------------------===
+# Half precision
+#===------------------------------------------------------------------===
+
+def emit_half_to_float(builder, h):
+    "Convert the bits h of a half to float, like C's npy_half_to_float"
+    int16, int32 = ltypes.l_half, lc.Type.int(32)
+    const16 = lambda value: lc.Constant.int(int16, value)
+    const32 = lambda value: lc.Constant.int(int32, value)
+
+    # Exponent and mantissa in place, then scale by 2**(127 - 15): this also
+    # normalizes subnormal halves
+    bits = builder.shl(builder.zext(builder.and_(h, const16(0x7fff)), int32),
+                       const32(13))
+    f = builder.fmul(builder.bitcast(bits, ltypes.l_float),
+                     lc.Constant.real(ltypes.l_float, 2.0 ** 112))
+    bits = builder.bitcast(f, int32)
+    is_special = builder.fcmp(lc.FCMP_OGE, f,
+                              lc.Constant.real(ltypes.l_float, 65536.0))
+    bits = builder.select(is_special, builder.or_(bits, const32(255 << 23)),
+                          bits)
+    sign = builder.shl(builder.zext(builder.and_(h, const16(0x8000)), int32),
+                       const32(16))
+    return builder.bitcast(builder.or_(bits, sign), ltypes.l_float)
+
+def emit_float_to_half(builder, f):
+    """
+    Round a float to the bits of the nearest half, like C's npy_float_to_half
+    """
+    int32 = lc.Type.int(32)
+    const32 = lambda value: lc.Constant.int(int32, value)
+
+    x = builder.bitcast(f, int32)
+    sign = builder.and_(x, const32(0x80000000))
+    x = builder.xor(x, sign)
+
+    # Overflows to inf, nan becomes a quiet nan
+    special = builder.select(builder.icmp(lc.ICMP_UGT, x, const32(255 << 23)),
+                             const32(0x7e00), const32(0x7c00))
+
+    # Subnormal or zero: let the float addition round the mantissa
+    denorm_magic = 126 << 23 # 0.5
+    subnormal = builder.fadd(builder.bitcast(x, ltypes.l_float),
+                             lc.Constant.real(ltypes.l_float, 0.5))
+    subnormal = builder.sub(builder.bitcast(subnormal, int32),
+                            const32(denorm_magic))
+
+    # Rebias the exponent and round the mantissa to nearest even
+    mant_odd = builder.and_(builder.lshr(x, const32(13)), const32(1))
+    rebias = (((15 - 127) << 23) + 0xfff) % 2 ** 32
+    normal = builder.add(builder.add(x, const32(rebias)), mant_odd)
+    normal = builder.lshr(normal, const32(13))
+
+    result = builder.select(builder.icmp(lc.ICMP_ULT, x, const32(113 << 23)),
+                            subnormal, normal)
+    result = builder.select(builder.icmp(lc.ICMP_UGE, x,
+                                         const32((127 + 16) << 23)),
+                            special, result)
+    result = builder.or_(result, builder.lshr(sign, const32(16)))
+    return builder.trunc(result, ltypes.l_half)
+
+half_conversions = {
+    'half_to_float': (emit_half_to_float, ltypes.l_half, ltypes.l_float),
+    'float_to_half': (emit_float_to_half, ltypes.l_float, ltypes.l_half),
+}
+
+def half_conversion(module, name):
+    "Get the function llvmmath.<name> for a conversion in half_conversions"
+    emit, argtype, restype = half_conversions[name]
+    fname = 'llvmmath.%s' % (name,)
+    if have_lfunc(module, fname):
+        return module.get_function_named(fname)
+
+    lfunc = module.add_function(lc.Type.function(restype, [argtype]), fname)
+    lfunc.linkage = lc.LINKAGE_INTERNAL
+    builder = lc.Builder.new(lfunc.append_basic_block('entry'))
+    builder.ret(emit(builder, lfunc.args[0]))
+    return lfunc
+
+def half_name(name):
+    """
+    Name of math function 'name' on halves, to map abstract math functions
+    on halves to in the replacements, e.g. { 'my.half.sin': 'half.sin' }.
+    Halves are stored as i16, so the name tells them apart from integers.
+    """
+    return 'half.' + name
+
+def promote_half(module, library, replacements):
+    """
+    Compute math functions on halves (ltypes.l_half) by promoting the
+    arguments to float and rounding the result back. Abstract math functions
+    are on halves if they are replaced with a half_name():
+
+        %r = call i16 @my.half.sin(i16 %x) ; replaced with 'half.sin'
+
+    becomes
+
+        %xf = call float @llvmmath.half_to_float(i16 %x)
+        %rf = call float @llvmmath.sin.float(float %xf)
+        %r = call i16 @llvmmath.float_to_half(float %rf)
+
+    The library has no functions on halves, so the abstract functions are
+    deleted once they are no longer used. link_llvm_math_intrinsics always
+    runs this rewrite.
+    """
+    promoted = set() # names of the abstract functions on halves
+    prefix = half_name('')
+    names = set(name for name in replacements.values()
+                         if name.startswith(prefix))
+    for bb, calls in list(math_calls(module, replacements, names)):
+        for i, callinst, name in calls:
+            absname = callinst.called_function.name
+            name = name[len(prefix):]
+            args = callinst.operands[:-1] # the callee is the last operand
+            if not (ltypes.is_half(callinst.type) and args and
+                    all(ltypes.is_half(arg.type) for arg in args)):
+                raise TypeError("Function %s on halves must take and return "
+                                "%s" % (absname, ltypes.l_half))
+
+            l_float = ltypes.l_float
+            func = declare_math(module, library, replacements, name,
+                                l_float, [l_float] * len(args))
+            if func is None:
+                raise LookupError("Math function %s not available for "
+                                  "float, needed by %s" % (name, absname))
+
+            to_float = half_conversion(module, 'half_to_float')
+            to_half = half_conversion(module, 'float_to_half')
+
+            builder = lc.Builder.new(bb)
+            builder.position_before(callinst)
+            result = builder.call(func, [builder.call(to_float, [arg])
+                                             for arg in args])
+            promoted.add(absname)
+            replace_call(callinst, builder.call(to_half, [result]))
+
+    for absname in promoted:
+        abstract = module.get_function_named(absname)
+        if not abstract._ptr.list_use():
+            abstract.delete()
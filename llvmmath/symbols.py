@@ -23,20 +23,27 @@ with open(symbolfile) as fin:
 typemap = {
     'int': ltypes.integral,
     'float': ltypes.floating,
-    'complex': ltypes.complexes
+    'complex': ltypes.complexes,
+    'pair': ltypes.pairs,
 }
 
 # ______________________________________________________________________
 # Retrieve symbols
 
 class MathLib(object):
-    def __init__(self, libm, mangler=naming.mathname, have_symbol=None):
+    def __init__(self, libm, mangler=naming.mathname, have_symbol=None,
+                 pairs=False):
         """
         :param mangler: (name, Signature) -> math_name
+        :param pairs: whether the library implements the functions with pair
+                      results, like mathcode's npy_sincos. C libraries don't
+                      have them in standard C (e.g. sincos is a GNU
+                      extension).
         """
         self.libm = libm
         self.mangle = mangler
         self._have_symbol = have_symbol
+        self.pairs = pairs
 
     def have_symbol(self, cname):
         if self._have_symbol is None:
@@ -58,6 +65,12 @@ class LLVMMath(MathLib):
 
 # ______________________________________________________________________
 
+def symbol_signatures(symbol):
+    "Get the Signatures of a symbol from the symbol file for all its types"
+    types = (symbol.restype,) + symbol.argtypes
+    for ltys in zip(*[typemap[ty] for ty in types]):
+        yield ltypes.Signature(ltys[0], ltys[1:])
+
 def get_symbols(library, mathlib, required_symbols=required_symbols):
     """
     Populate a dict with runtime addressed of math functions from a given
@@ -67,9 +80,10 @@ def get_symbols(library, mathlib, required_symbols=required_symbols):
     :param mathlib: ctypes or LLVM library of math functions
     """
     for symbol in required_symbols:
-        types = (symbol.restype,) + symbol.argtypes
-        for ltys in zip(*[typemap[ty] for ty in types]):
-            sig = ltypes.Signature(ltys[0], ltys[1:])
+        if symbol.restype == 'pair' and not mathlib.pairs:
+            continue
+
+        for sig in symbol_signatures(symbol):
             if library.get_symbol(symbol.name, sig):
                 # Duplicate symbol, e.g. llabs -> labs when
                 # sizeof(long) == sizeof(longlong)
@@ -78,7 +92,8 @@ def get_symbols(library, mathlib, required_symbols=required_symbols):
             cname = mathlib.mangle(symbol.name, sig)
             if mathlib.have_symbol(cname):
                 libm_symbol = mathlib.get_libm_symbol(cname)
-                library.add_symbol(symbol.name, sig, libm_symbol)
+                library.add_symbol(symbol.name, sig, libm_symbol,
+                                   symbol.attrs)
             else:
                 library.missing.append((symbol.name, cname, sig))
 
@@ -3,9 +3,11 @@ from __future__ import print_function, division, absolute_import
 
 from functools import partial
 
-from llvmmath import ltypes
+import ctypes
+
+from llvmmath import ltypes, callconv, complex_support, llvm_support
 from llvmmath.tests import support
-from llvmmath.tests.support import test
+from llvmmath.tests.support import test, skip_if
 
 from llvm.core import *
 
@@ -21,6 +23,12 @@ def test_complex_abi_byref():
     run_byref(ltypes.l_complex128)
     run_byref(ltypes.l_complex256)
 
+@test
+@skip_if(callconv.complex_lowering is None)
+def test_complex_abi_native():
+    run_native(ltypes.l_complex64)
+    run_native(ltypes.l_complex128)
+
 # ______________________________________________________________________
 
 def run(wrap, call_wrapped, ty):
@@ -37,6 +45,24 @@ run_byval = partial(run, support.create_byval_wrapper,
 run_byref = partial(run, support.create_byref_wrapper,
                     support.call_complex_byref)
 
+def run_native(ty):
+    "Call through the native ABI from ctypes, which follows the C ABI"
+    engine, mod, pm = support.make_llvm_context()
+    double_func = make_double_func(mod, ty)
+
+    sig = callconv.convention_cbyval(ltypes.Signature(ty, [ty]))
+    f = mod.add_function(Type.function(sig.restype, sig.argtypes), 'wrapper')
+    b = Builder.new(f.append_basic_block('entry'))
+    arg = complex_support.raise_complex_value(b, f.args, ty)
+    result = b.call(double_func, [arg])
+    b.ret(complex_support.lower_complex_value(b, result, [sig.restype])[0])
+
+    c_complex = llvm_support.map_llvm_to_ctypes(ty)
+    functype = ctypes.CFUNCTYPE(c_complex, c_complex)
+    wrapper = functype(engine.get_pointer_to_function(f))
+    result = support.call_complex_byval(wrapper, 5+6j)
+    assert result == 10+12j, result
+
 # ______________________________________________________________________
 
 def make_double_func(mod, ty):
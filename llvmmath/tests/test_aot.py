@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import math
+import types
+import shutil
+import tempfile
+from os.path import join
+
+from llvmmath import aot, have_llvm_asm
+from llvmmath.tests.support import test, skip_if
+from llvmmath.tests.test_objcache import make_sin_module
+
+# ______________________________________________________________________
+
+@test
+@skip_if(not have_llvm_asm())
+def test_compile_module():
+    "Test compiling a module ahead of time and loading it back"
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = join(tempdir, 'kernels.so')
+        aot.compile_module(make_sin_module(), filename)
+
+        mod = aot.load_module(filename, types.ModuleType('aotmod'))
+        assert mod.mysin(10.0) == math.sin(10.0)
+    finally:
+        shutil.rmtree(tempdir)
@@ -33,10 +33,86 @@ def test_build_llvm():
     finally:
         shutil.rmtree(tempdir)
 
+@test
+@skip_if(not have_clang())
+def test_build_llvm_without_llvm_link():
+    "Building without llvm-link deletes the per-family modules of old builds"
+    tempdir = tempfile.mkdtemp()
+    try:
+        stale = [join(tempdir, 'mathcode.index.json'),
+                 join(tempdir, 'mathcode_funcs.bc')]
+        for filename in stale:
+            open(filename, 'w').close()
+
+        config = build.mkconfig(build.default_config,
+                                llvm_link='llvmmath-no-such-llvm-link',
+                                output_dir=tempdir)
+        build.build_llvm(config)
+        assert exists(join(tempdir, 'mathcode.s'))
+        assert not any(exists(filename) for filename in stale)
+        assert build.load_llvm_index(stale[0]) is None
+    finally:
+        shutil.rmtree(tempdir)
+
 print(test_build_llvm, vars(test_build_llvm))
 #
 # ______________________________________________________________________
 
+def copy_sources():
+    "Copy the math sources to a temporary directory"
+    tempdir = tempfile.mkdtemp()
+    source_dir = join(tempdir, 'mathcode')
+    shutil.copytree(build.mathcode, source_dir)
+    return tempdir, source_dir
+
+@test
+def test_build_source_incremental():
+    "Test that unchanged templates are not expanded again"
+    tempdir, source_dir = copy_sources()
+    try:
+        build.build_source(source_dir=source_dir)
+        for fn in build.templates:
+            assert exists(join(source_dir, fn[:-len('.src')])), fn
+        assert exists(join(source_dir, build.hashfile_name))
+
+        assert build.build_source(source_dir=source_dir) == []
+
+        # Remove a generated file, it should be regenerated
+        os.remove(join(source_dir, 'ieee754.c'))
+        assert build.build_source(source_dir=source_dir) == ['ieee754.c.src']
+    finally:
+        shutil.rmtree(tempdir)
+
+# Template processor writing file.c for file.c.src, like conv_template.py
+custom_conv_templ = """
+import sys
+fn = sys.argv[1]
+with open(fn) as fin, open(fn[:-len('.src')], 'w') as fout:
+    fout.write('/* custom */\\n' + fin.read())
+"""
+
+@test
+def test_build_source_custom_conv_templ():
+    "Test a custom template processor taking the file to expand"
+    tempdir, source_dir = copy_sources()
+    try:
+        script = join(tempdir, 'conv_templ.py')
+        with open(script, 'w') as f:
+            f.write(custom_conv_templ)
+
+        config = build.mkconfig(build.default_config, conv_templ=script)
+        processed = build.build_source(config, source_dir=source_dir)
+        assert set(build.templates) <= set(processed), processed
+        for fn in build.templates:
+            with open(join(source_dir, fn[:-len('.src')])) as f:
+                assert f.read().startswith('/* custom */'), fn
+
+        assert build.build_source(config, source_dir=source_dir) == []
+    finally:
+        shutil.rmtree(tempdir)
+
+# ______________________________________________________________________
+
 @skip_if(not have_llvm_asm())
 def get_llvm_lib(asmfile=None):
     "Test getting the llvm lib from a clean environment"
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+
+from llvmmath import kernels
+from llvmmath.tests.support import test
+from llvmmath.tests.test_libs import ufunc_map, reference_impls
+
+# ______________________________________________________________________
+
+x = np.linspace(0.1, 0.9, 17) + 0.2j * np.linspace(1, 2, 17)
+y = x[::-1] + 1
+
+def npy_func(name):
+    if name == 'abs':
+        return np.abs
+    return getattr(np, ufunc_map.get(name, name))
+
+def check(name, layout, dtype):
+    args = [a.astype(dtype) for a in (x, y)[:kernels._nargs(name)]]
+    expected = npy_func(name)(*args)
+
+    if layout == 'split':
+        parts = [part for a in args for part in (a.real, a.imag)]
+        result = kernels.split(name, *parts)
+        if name != 'abs':
+            result = result[0] + 1j * result[1]
+    else:
+        result = kernels.interleaved(name, *args)
+
+    rtol = 1e-4 if dtype == np.complex64 else 1e-10
+    assert np.allclose(result, expected, rtol=rtol), (name, layout, dtype)
+
+@test
+def test_split():
+    for name in kernels.unary + kernels.binary:
+        for dtype in (np.complex64, np.complex128):
+            check(name, 'split', dtype)
+
+@test
+def test_interleaved():
+    for name in kernels.unary + kernels.binary:
+        for dtype in (np.complex64, np.complex128):
+            check(name, 'interleaved', dtype)
+
+# ______________________________________________________________________
+
+h = np.linspace(0.1, 0.9, 17).astype(np.float16)
+hy = h[::-1] + np.float16(1)
+
+@test
+def test_half():
+    for name in kernels.half_unary + kernels.half_binary:
+        args = (h, hy)[:2 if name in kernels.half_binary else 1]
+        func = reference_impls.get(name) or npy_func(name)
+        with np.errstate(invalid='ignore'):
+            expected = func(*[a.astype(np.float64) for a in args])
+
+        result = kernels.half(name, *args)
+        assert result.dtype == np.float16, name
+        # Computing in float may round to the neighbouring half
+        assert np.allclose(result.astype(np.float64), expected, rtol=2e-3,
+                           equal_nan=True), name
+
+@test
+def test_half_conversions():
+    halves = np.arange(2 ** 16, dtype=np.uint16).view(np.float16)
+    nan = np.isnan(halves)
+
+    floats = kernels.half_to_float(halves)
+    assert floats.dtype == np.float32
+    assert np.isnan(floats[nan]).all()
+    assert (floats[~nan].view(np.uint32) ==
+            halves[~nan].astype(np.float32).view(np.uint32)).all()
+
+    # Exact, ties to even and values in between halves
+    for factor in (1, 1 + 2.0 ** -11, 1 + 2.0 ** -12, 1 - 2.0 ** -13):
+        x = floats[~nan] * np.float32(factor)
+        with np.errstate(over='ignore'):
+            expected = x.astype(np.float16)
+        result = kernels.float_to_half(x)
+        assert result.dtype == np.float16
+        assert (result.view(np.uint16) == expected.view(np.uint16)).all()
+    assert np.isnan(kernels.float_to_half(floats[nan])).all()
@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import
 
+import math
 from functools import partial
 
 import llvm.core as lc
 import numpy as np
 
-from llvmmath import ltypes, libs
+from llvmmath import ltypes, libs, build, callconv
 from llvmmath.tests import support
-from llvmmath.tests.support import test
+from llvmmath.tests.support import test, skip_if
 
 # ______________________________________________________________________
 
@@ -51,16 +52,40 @@ ufunc_map = {
     'atanh': 'arctanh',
     'atan2': 'arctan2',
     'pow'  : 'power',
+    'neg'  : 'negative',
+    'sum'  : 'add',
+    'diff' : 'subtract',
+    'prod' : 'multiply',
+    'quot' : 'divide',
 }
 
-def run(c_func, name, sig, dtype):
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+# Reference implementations of functions numpy doesn't have
+reference_impls = {
+    'fma': lambda x, y, z: x * y + z,
+    'erf': np.vectorize(math.erf),
+    'erfc': np.vectorize(math.erfc),
+    'lgamma': np.vectorize(math.lgamma),
+    'tgamma': np.vectorize(math.gamma),
+    'cbrt': lambda x: np.sign(x) * np.abs(x) ** (1.0 / 3.0),
+    'exp10': lambda x: 10.0 ** x,
+}
+
+def run(c_func, name, sig, dtype, byval=False):
     print("Running %s %s" % (name, sig))
     nargs = len(sig.argtypes)
     npy_name = ufunc_map.get(name, name)
-    npy_func = getattr(np, npy_name)
+    npy_func = reference_impls.get(name) or getattr(np, npy_name)
 
     if sig.restype.kind == lc.TYPE_STRUCT:
-        c_func = partial(support.call_complex_byref, c_func)
+        if byval:
+            c_func = partial(support.call_complex_byval, c_func)
+        else:
+            c_func = partial(support.call_complex_byref, c_func)
         test_data = get_cdata(npy_name, dtype)
     else:
         test_data = get_idata(npy_name, dtype)
@@ -78,12 +103,16 @@ def run(c_func, name, sig, dtype):
 
 def run_from_types(library, types):
     for name, signatures in library.symbols.items():
+        if name in int_reference_impls:
+            continue # see test_integer_functions
+
         sample_sig = list(signatures)[0]
         for ty, dtype in zip(types, npy_typemap[tuple(map(str, types))]):
             sig = ltypes.Signature(ty, [ty] * len(sample_sig.argtypes))
             if sig in signatures:
                 ctypes_func = library.get_ctypes_symbol(name, sig)
-                run(ctypes_func, name, sig, dtype)
+                run(ctypes_func, name, sig, dtype,
+                    byval=library.passes_complex_byval(sig))
 
 @test
 def test_math():
@@ -93,6 +122,29 @@ def test_math():
     run_from_types(lib, ltypes.floating)
     run_from_types(lib, ltypes.complexes)
 
+@test
+@skip_if(callconv.complex_lowering is None)
+def test_native_math():
+    "Test passing complex numbers by value"
+    lib = libs.get_native_mathlib_so()
+    assert not lib.missing, lib.missing
+    run_from_types(lib, ltypes.complexes)
+
+    # Complex abs passes its argument by value
+    cabs = lib.get_ctypes_symbol(
+        'abs', ltypes.Signature(ltypes.l_double, [ltypes.l_complex128]))
+    x = -2.2 - 3.3j
+    assert np.allclose(cabs(cabs.argtypes[0](x.real, x.imag)), abs(x))
+
+@test
+def test_default_convention():
+    "The default library passes complex numbers by reference"
+    lib = libs.get_default_math_lib()
+    assert lib.calling_convention is callconv.convention_cbyref
+    if callconv.complex_lowering is not None:
+        lib = libs.get_default_math_lib(native=True)
+        assert lib.calling_convention is callconv.convention_cbyval
+
 @test
 def test_abs():
     "Test abs() with negative numbers"
@@ -118,4 +170,76 @@ def test_abs():
     x = -2.2 - 3.3j
     result = call(cabsf, x), call(cabs, x), call(cabsl, x)
     result = [r.value for r in result]
-    assert np.allclose(result, [abs(x)] * 3), result
\ No newline at end of file
+    assert np.allclose(result, [abs(x)] * 3), result
+
+def wrap(x, bits):
+    "Wrap integer x around to a signed integer of the given width"
+    x &= (1 << bits) - 1
+    return x - (1 << bits) if x >> (bits - 1) else x
+
+def saturate(x, bits):
+    return max(-(1 << (bits - 1)), min(x, (1 << (bits - 1)) - 1))
+
+def ipow(x, n):
+    if n >= 0:
+        return x ** n
+    elif x == -1:
+        return -1 if n & 1 else 1
+    return int(x == 1)
+
+def bswap(x, bits):
+    result = 0
+    for i in range(bits // 8):
+        result = (result << 8) | ((x >> (8 * i)) & 0xff)
+    return result
+
+# Python implementations of the integer functions on integers of a width,
+# { name : f(bits, *args) }
+int_reference_impls = {
+    'popcount': lambda bits, x: bin(x & ((1 << bits) - 1)).count('1'),
+    'clz': lambda bits, x: bits - (x & ((1 << bits) - 1)).bit_length(),
+    'ctz': lambda bits, x: (x & -x).bit_length() - 1 if x else bits,
+    'bswap': lambda bits, x: wrap(bswap(x, bits), bits),
+    'ipow': lambda bits, x, n: wrap(ipow(x, n), bits),
+    'gcd': lambda bits, x, y: wrap(gcd(x, y), bits),
+    'sat_add': lambda bits, x, y: saturate(x + y, bits),
+    'sat_sub': lambda bits, x, y: saturate(x - y, bits),
+}
+
+def int_inputs(bits):
+    "Interesting arguments for integer functions of the given width"
+    big = (1 << (bits - 1)) - 1
+    return [0, 1, -1, 2, 7, -12, 40, 0x12345678, -0x12345678, big, -big - 1]
+
+int_binary = ('ipow', 'gcd', 'sat_add', 'sat_sub')
+
+def check_int_function(f, name, bits):
+    reference = int_reference_impls[name]
+    for x in int_inputs(bits):
+        if name not in int_binary:
+            assert f(x) == reference(bits, x), (name, bits, x, f(x))
+            continue
+        for y in int_inputs(bits):
+            if name == 'ipow':
+                y = y % 70 - 5 # small exponents, including negative ones
+            assert f(x, y) == reference(bits, x, y), (name, bits, x, y)
+
+@test
+def test_integer_functions():
+    "Test integer functions with negative numbers, zero and extremes"
+    lib = libs.get_mathlib_so()
+    for name in int_reference_impls:
+        nargs = 2 if name in int_binary else 1
+        for ty in ltypes.integral:
+            f = lib.get_ctypes_symbol(name, ltypes.Signature(ty, [ty] * nargs))
+            check_int_function(f, name, ty.width)
+
+@test
+@skip_if(build.load_llvm_index() is None)
+def test_partial_llvm_mathlib():
+    "Test loading only the math families needed for some functions"
+    lib = libs.get_partial_llvm_mathlib(['sin', 'pow'])
+    assert sorted(lib.symbols) == ['pow', 'sin'], list(lib.symbols)
+    assert not lib.missing, lib.missing
+    run_from_types(lib, ltypes.floating)
+    run_from_types(lib, ltypes.complexes)
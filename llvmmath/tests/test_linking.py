@@ -2,13 +2,15 @@
 from __future__ import print_function, division, absolute_import
 
 import ctypes
+from functools import partial
 from collections import namedtuple
 import math
 import cmath
 
-from llvmmath import ltypes, linking, libs, have_llvm_asm
-from llvmmath.tests import support
-from llvmmath.tests.support import parametrize
+from llvmmath import ltypes, linking, libs, rewrites, callconv, have_llvm_asm
+from llvmmath.tests import support, test_libs
+from llvmmath.tests.support import parametrize, test, skip_if
+from llvmmath.complex_support import have_lfunc
 
 import numpy as np
 from llvm.core import *
@@ -16,14 +18,33 @@ from llvm.core import *
 # ______________________________________________________________________
 
 sinname = 'my_custom_sin'
+othersinname = 'my.other.sin'
 cosname = 'my.custom.cos'
 powname = 'my.special.pow'
+prodname = 'my.complex.prod'
+quotname = 'my.complex.quot'
+sqrtname = 'my.sqrt'
+floorname = 'my.floor'
+ceilname = 'my.ceil'
+truncname = 'my.trunc'
+fmaname = 'my.fma'
+int_names = ['popcount', 'clz', 'ctz', 'bswap', 'ipow', 'gcd', 'sat_add',
+             'sat_sub']
 
 namemap = {
     sinname: 'sin',
+    othersinname: 'sin',
     cosname: 'cos',
     powname: 'pow',
+    prodname: 'prod',
+    quotname: 'quot',
+    sqrtname: 'sqrt',
+    floorname: 'floor',
+    ceilname: 'ceil',
+    truncname: 'trunc',
+    fmaname: 'fma',
 }
+namemap.update(('my.int.%s' % name, name) for name in int_names)
 
 mkname = lambda name, ty: '%s%d' % (name, ltypes.all_types.index(ty))
 
@@ -44,10 +65,10 @@ class _Ctx(namedtuple('Ctx', "engine module pm lib linker, replacements")):
     def mkbyref(self, defname, callname, ty):
         return make_func(self, defname, mkname(callname, ty), ty, byref=True)
 
-    def link(self):
+    def link(self, rewrites=()):
         engine, mod, pm, lib, linker, replacements = self
         linking.link_llvm_math_intrinsics(
-            engine, mod, lib, linker, replacements)
+            engine, mod, lib, linker, replacements, rewrites)
         mod.verify()
 
         # Using the module optimizer to inline all functions remove a segfault
@@ -75,6 +96,16 @@ def make_contexts():
         ctx2 = new_ctx(lib=asm, linker=asm_linker)
         contexts.append(ctx2)
 
+    if callconv.complex_lowering is not None:
+        # Pass complex numbers by value
+        native_so = libs.get_native_mathlib_so()
+        contexts.append(new_ctx(lib=native_so,
+                                linker=linking.ExternalLibraryLinker()))
+        if have_llvm_asm():
+            native_asm = libs.get_native_llvm_mathlib()
+            contexts.append(new_ctx(lib=native_asm,
+                                    linker=linking.LLVMLinker()))
+
     return contexts
 
 def make_func(ctx, defname, callname, ty, nargs=1, byref=False):
@@ -140,6 +171,185 @@ def test_link_complex(ctx):
     print("got:", r1, r2, r3)
     assert np.allclose([result] * 3, [r1, r2, r3])
 
+def wrappers(module):
+    return [f.name for f in module.functions
+                if f.name.startswith(('llvmmath.complexwrapper.',
+                                      'llvmmath.externalwrap.',
+                                      'llvmmath.external.'))]
+
+@parametrize(ctx=make_contexts())
+def test_reuse_complex_wrappers(ctx):
+    ty = ltypes.l_complex128
+    ctx.mkbyref('mycsin', sinname, ty)
+    ctx.mkbyref('myothercsin', othersinname, ty)
+    ctx.link()
+
+    # Both abstract functions resolve to the same npy_csin
+    names = wrappers(ctx.module)
+    assert len(names) == len(set(names)) <= 2, names
+
+    m = support.make_mod(ctx)
+    input = 10+2j
+    r1 = support.call_complex_byref(m.mycsin, input)
+    r2 = support.call_complex_byref(m.myothercsin, input)
+    assert np.allclose([r1, r2], [cmath.sin(input)] * 2)
+
+@test
+def test_shared_wrappers():
+    lib = libs.get_mathlib_so()
+    linker = linking.ExternalLibraryLinker(
+        shared_wrappers=linking.SharedWrappers())
+
+    ty = ltypes.l_complex128
+    for input in (10+2j, 1-3j):
+        ctx = new_ctx(lib, linker)
+        ctx.mkbyref('mycsin', sinname, ty)
+        ctx.link()
+        assert not wrappers(ctx.module), wrappers(ctx.module)
+
+        m = support.make_mod(ctx)
+        result = support.call_complex_byref(m.mycsin, input)
+        assert np.allclose(result, cmath.sin(input))
+
+    assert len(linker.shared_wrappers.addresses) == 1
+
+def defined(module):
+    return [f.name for f in module.functions if not f.is_declaration]
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_shared_llvm_linker():
+    lib = libs.get_llvm_mathlib()
+    linker = linking.SharedLLVMLinker()
+
+    for input in (0.5, 2.0):
+        ctx = new_ctx(lib, linker)
+        ctx.mkbyval('mysin', sinname, ltypes.l_double)
+        ctx.mkbyref('mycsin', sinname, ltypes.l_complex128)
+        ctx.link()
+
+        # Only our own functions and wrappers are defined in the module
+        assert not [name for name in defined(ctx.module)
+                        if name.startswith(('npy_', 'nc_'))]
+
+        m = support.make_mod(ctx)
+        assert np.allclose(m.mysin(input), math.sin(input))
+        result = support.call_complex_byref(m.mycsin, complex(input, 1))
+        assert np.allclose(result, cmath.sin(complex(input, 1)))
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_shared_llvm_linker_inline():
+    lib = libs.get_llvm_mathlib()
+    linker = linking.SharedLLVMLinker(inline_size=1000)
+    ctx = new_ctx(lib, linker)
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    ctx.mkbyref('mycsin', sinname, ltypes.l_complex128)
+    ctx.link()
+
+    inline_module = linker.get_inline_module(lib)
+    for name in defined(ctx.module):
+        if name.startswith(('npy_', 'nc_')):
+            assert linking.is_small_leaf(
+                inline_module.get_function_named(name), 1000)
+
+    m = support.make_mod(ctx)
+    assert np.allclose(m.mysin(0.5), math.sin(0.5))
+    result = support.call_complex_byref(m.mycsin, 0.5+1j)
+    assert np.allclose(result, cmath.sin(0.5+1j))
+
+def make_incremental_contexts():
+    contexts = [new_ctx(libs.get_mathlib_so(),
+                        linking.ExternalLibraryLinker(incremental=True))]
+    if have_llvm_asm():
+        contexts.append(new_ctx(libs.get_llvm_mathlib(),
+                                linking.LLVMLinker(incremental=True)))
+    return contexts
+
+@parametrize(ctx=make_incremental_contexts())
+def test_link_incremental(ctx):
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    ctx.link()
+    nfuncs = len(list(ctx.module.functions))
+
+    # Nothing new to link
+    ctx.link()
+    assert len(list(ctx.module.functions)) == nfuncs
+
+    ctx.mkbyval('mycos', cosname, ltypes.l_double)
+    ctx.mkbyval('mysin2', sinname, ltypes.l_double)
+    ctx.link()
+
+    m = support.make_mod(ctx)
+    assert np.allclose([m.mysin(0.5), m.mycos(0.5), m.mysin2(0.5)],
+                       [math.sin(0.5), math.cos(0.5), math.sin(0.5)])
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_link_incremental_drops_unused():
+    ctx = new_ctx(libs.get_llvm_mathlib(), linking.LLVMLinker(incremental=True))
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    unused = mkname(powname, ltypes.l_double)
+    ctx.module.get_or_insert_function(
+        Type.function(ltypes.l_double, [ltypes.l_double] * 2), unused)
+    ctx.link()
+
+    assert not have_lfunc(ctx.module, unused)
+    for lfunc in ctx.module.functions:
+        if lfunc.name.startswith('npy_') and not lfunc.is_declaration:
+            assert lfunc.linkage == LINKAGE_INTERNAL, lfunc.name
+    assert not have_lfunc(ctx.module, 'npy_cos')
+
+    # Compile, then link in a function dropped by the first link
+    m = support.make_mod(ctx)
+    assert np.allclose(m.mysin(0.5), math.sin(0.5))
+    ctx.mkbyval('mycos', cosname, ltypes.l_double)
+    ctx.link()
+
+    m = support.make_mod(ctx)
+    assert np.allclose([m.mysin(0.5), m.mycos(0.5)],
+                       [math.sin(0.5), math.cos(0.5)])
+
+def make_concurrent_module(ctx):
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    ctx.mkbyval('mycos', cosname, ltypes.l_double)
+    ctx.mkbyref('mycsin', sinname, ltypes.l_complex128)
+
+def check_concurrent_module(ctx, i):
+    ctx.module.verify()
+    m = support.make_mod(ctx)
+
+    x = i / 10.0
+    assert np.allclose([m.mysin(x), m.mycos(x)], [math.sin(x), math.cos(x)])
+    result = support.call_complex_byref(m.mycsin, complex(x, 1))
+    assert np.allclose(result, cmath.sin(complex(x, 1)))
+
+@test
+def test_link_threads():
+    from multiprocessing.pool import ThreadPool
+
+    def link(ctx):
+        # No locks held here: link_llvm_math_intrinsics must serialize
+        # itself against the other links
+        linking.link_llvm_math_intrinsics(ctx.engine, ctx.module, ctx.lib,
+                                          ctx.linker, ctx.replacements)
+
+    contexts = make_contexts()
+    nmodules = 16
+    pool = ThreadPool(8)
+    try:
+        for ctx in contexts:
+            # Build and run the modules in this thread, link in the pool
+            ctxs = [new_ctx(ctx.lib, ctx.linker) for i in range(nmodules)]
+            for c in ctxs:
+                make_concurrent_module(c)
+            pool.map(link, ctxs)
+            for i, c in enumerate(ctxs):
+                check_concurrent_module(c, i)
+    finally:
+        pool.close()
+        pool.join()
+
 # ______________________________________________________________________
 
 @parametrize(ctx=make_contexts())
@@ -162,6 +372,340 @@ def test_link_binary(ctx):
 
 # ______________________________________________________________________
 
+@parametrize(ctx=make_contexts())
+def test_fuse_sincos(ctx):
+    ty = ltypes.l_double
+    fty = Type.function(ty, [ty])
+    sin = ctx.module.get_or_insert_function(fty, mkname(sinname, ty))
+    cos = ctx.module.get_or_insert_function(fty, mkname(cosname, ty))
+
+    f = ctx.module.add_function(fty, 'mysincos')
+    b = Builder.new(f.append_basic_block('entry'))
+    x, = f.args
+    b.ret(b.fadd(b.call(sin, [x]), b.call(cos, [x])))
+
+    def fuse_sincos(module, library, replacements):
+        rewrites.fuse_sincos(module, library, replacements)
+        assert replacements['llvmmath.sincos.double'] == 'sincos'
+        assert not sin._ptr.list_use() and not cos._ptr.list_use()
+
+    ctx.link(rewrites=[fuse_sincos])
+    m = support.make_mod(ctx)
+    assert np.allclose(m.mysincos(10.0), math.sin(10.0) + math.cos(10.0))
+
+# ______________________________________________________________________
+
+exponents = [0, 1, 2, -1, 0.5, 3, -4]
+
+def make_pow_funcs(ctx, ty, exponents, make_exponent):
+    "Create functions mypow<i>(x) calling pow(x, exponents[i])"
+    fty = Type.function(ty, [ty, ty])
+    pow = ctx.module.get_or_insert_function(fty, mkname(powname, ty))
+    for i, y in enumerate(exponents):
+        f = ctx.module.add_function(Type.function(ty, [ty]), 'mypow%d' % i)
+        b = Builder.new(f.append_basic_block('entry'))
+        b.ret(b.call(pow, [f.args[0], make_exponent(y)]))
+    return pow
+
+def check_reduce_pow(ctx, relaxed, nleft):
+    ty = ltypes.l_double
+    pow = make_pow_funcs(ctx, ty, exponents, partial(Constant.real, ty))
+
+    def reduce_pow(module, library, replacements):
+        rewrites.reduce_pow(module, library, replacements, relaxed)
+        assert len(pow._ptr.list_use()) == nleft
+
+    ctx.link(rewrites=[reduce_pow])
+    m = support.make_mod(ctx)
+    for i, y in enumerate(exponents):
+        assert np.allclose(getattr(m, 'mypow%d' % i)(2.5), 2.5 ** y)
+
+@parametrize(ctx=make_contexts())
+def test_reduce_pow(ctx):
+    check_reduce_pow(ctx, relaxed=False, nleft=3) # 0.5, 3, -4
+
+@parametrize(ctx=make_contexts())
+def test_reduce_pow_relaxed(ctx):
+    check_reduce_pow(ctx, relaxed=True, nleft=0)
+
+@parametrize(ctx=make_contexts())
+def test_reduce_complex_pow(ctx):
+    ty = ltypes.l_complex128
+    real = partial(Constant.real, ltypes.l_double)
+    complex_exponent = lambda n: Constant.struct([real(n), real(0)])
+    pow = make_pow_funcs(ctx, ty, [0, 1, 2, 3, -2, 5], complex_exponent)
+    rewrites.reduce_pow(ctx.module, ctx.lib, ctx.replacements)
+    assert not pow._ptr.list_use()
+
+    for i in range(6):
+        support.create_byref_wrapper(ctx.module.get_function_named('mypow%d' % i),
+                                     'mycpow%d' % i)
+    ctx.link()
+    m = support.make_mod(ctx)
+
+    z = 1.5 + 0.5j
+    for i, n in enumerate([0, 1, 2, 3, -2, 5]):
+        result = support.call_complex_byref(getattr(m, 'mycpow%d' % i), z)
+        assert np.allclose(result, z ** n), (n, result, z ** n)
+
+        # nc_pow special-cases zero
+        result = support.call_complex_byref(getattr(m, 'mycpow%d' % i), 0j)
+        if n < 0:
+            assert np.isnan(result), (n, result)
+        else:
+            assert np.allclose(result, 0 ** n), (n, result)
+
+# ______________________________________________________________________
+
+@parametrize(ctx=make_contexts())
+def test_fold_constants(ctx):
+    ty = ltypes.l_double
+    real = partial(Constant.real, ty)
+    sin = ctx.module.get_or_insert_function(Type.function(ty, [ty]),
+                                            mkname(sinname, ty))
+    pow = ctx.module.get_or_insert_function(Type.function(ty, [ty, ty]),
+                                            mkname(powname, ty))
+
+    for fname, callee, args in [('mysin', sin, [real(10.0)]),
+                                ('mypow', pow, [real(-1.0), real(0.5)])]:
+        f = ctx.module.add_function(Type.function(ty, []), fname)
+        b = Builder.new(f.append_basic_block('entry'))
+        b.ret(b.call(callee, args))
+
+    def fold_constants(module, library, replacements):
+        rewrites.fold_constants(module, library, replacements)
+        assert not sin._ptr.list_use()
+        assert len(pow._ptr.list_use()) == 1 # domain error, may set errno
+
+    ctx.link(rewrites=[fold_constants])
+    m = support.make_mod(ctx)
+    assert m.mysin() == ctx.lib.get_ctypes_symbol(
+        'sin', ltypes.Signature(ty, [ty]))(10.0)
+    assert np.isnan(m.mypow())
+
+# ______________________________________________________________________
+
+fast_path_inputs = [-3e9, -2.5, -1.0, -0.5, -0.0, 0.0, 0.5, 1.0, 2.5, 3e9,
+                    float('inf'), float('-inf'), float('nan')]
+
+def same_float(x, y):
+    "Whether x and y are the same float, including the sign of zero"
+    return (np.isnan(x) and np.isnan(y)) or (
+        x == y and math.copysign(1, x) == math.copysign(1, y))
+
+@parametrize(ctx=make_contexts())
+def test_guard_fast_paths(ctx):
+    names = [(sqrtname, 'sqrt'), (floorname, 'floor'),
+             (ceilname, 'ceil'), (truncname, 'trunc')]
+    for ty in (ltypes.l_float, ltypes.l_double):
+        for absname, name in names:
+            ctx.mkbyval('my%s%s' % (name, ty), absname, ty)
+
+    def check_guarded(module, library, replacements):
+        rewrites.guard_fast_paths(module, library, replacements)
+        for ty in (ltypes.l_float, ltypes.l_double):
+            for absname, name in names:
+                guarded = 'llvmmath.guarded.%s' % mkname(absname, ty)
+                assert module.get_function_named(guarded)
+
+    ctx.link(rewrites=[check_guarded])
+    m = support.make_mod(ctx)
+
+    for ty in (ltypes.l_float, ltypes.l_double):
+        for absname, name in names:
+            f = getattr(m, 'my%s%s' % (name, ty))
+            expected = ctx.lib.get_ctypes_symbol(
+                name, ltypes.Signature(ty, [ty]))
+            for x in fast_path_inputs:
+                assert same_float(f(x), expected(x)), (name, ty, x, f(x))
+
+# ______________________________________________________________________
+
+# x * y rounds to 1.0, but is 1 - 2**-60 exactly
+fma_args = 1 + 2.0 ** -30, 1 - 2.0 ** -30, -1.0
+
+@parametrize(ctx=make_contexts())
+def test_fma(ctx):
+    ty = ltypes.l_double
+    make_func(ctx, 'myfma', mkname(fmaname, ty), ty, nargs=3)
+
+    def check_intrinsic(module, library, replacements):
+        assert not module.get_function_named(
+            mkname(fmaname, ty))._ptr.list_use()
+
+    ctx.link(rewrites=[check_intrinsic])
+    m = support.make_mod(ctx)
+    assert m.myfma(*fma_args) == -2.0 ** -60
+    assert m.myfma(2.0, 3.0, 4.0) == 10.0
+
+@test
+def test_contract_fma():
+    ty = ltypes.l_double
+    linker = linking.ExternalLibraryLinker(fp_contract=True)
+    ctx = new_ctx(libs.get_mathlib_so(), linker)
+
+    f = ctx.module.add_function(Type.function(ty, [ty] * 3), 'mymuladd')
+    b = Builder.new(f.append_basic_block('entry'))
+    x, y, z = f.args
+    b.ret(b.fadd(b.fmul(x, y), z))
+
+    linking.link_llvm_math_intrinsics(ctx.engine, ctx.module, ctx.lib,
+                                      linker, ctx.replacements)
+    assert 'llvm.fma.f64' in str(f), f
+
+    m = support.make_mod(ctx)
+    assert m.mymuladd(*fma_args) == -2.0 ** -60
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_contract_fma_own_functions():
+    ty = ltypes.l_double
+    linker = linking.LLVMLinker(fp_contract=True, intrinsics=False)
+    ctx = new_ctx(libs.get_llvm_mathlib(), linker)
+
+    f = ctx.module.add_function(Type.function(ty, [ty] * 3), 'mymuladd')
+    b = Builder.new(f.append_basic_block('entry'))
+    x, y, z = f.args
+    b.ret(b.fadd(b.fmul(x, y), z))
+    make_func(ctx, 'myfma', mkname(fmaname, ty), ty, nargs=3)
+    ctx.mkbyval('mysin', sinname, ty)
+
+    linking.link_llvm_math_intrinsics(ctx.engine, ctx.module, ctx.lib,
+                                      linker, ctx.replacements)
+
+    assert 'llvm.fma.f64' in str(f), f
+    # Linked math code keeps its separately rounded operations
+    for lfunc_math in ctx.lib.module.functions:
+        if linking.is_defined(ctx.module, lfunc_math.name):
+            lfunc = ctx.module.get_function_named(lfunc_math.name)
+            assert (('llvm.fma' in str(lfunc)) ==
+                    ('llvm.fma' in str(lfunc_math))), lfunc
+
+# ______________________________________________________________________
+
+@parametrize(ctx=make_contexts())
+def test_integer_functions(ctx):
+    for ty in ltypes.integral:
+        for name in int_names:
+            nargs = 2 if name in test_libs.int_binary else 1
+            make_func(ctx, mkname('my' + name, ty),
+                      mkname('my.int.%s' % name, ty), ty, nargs=nargs)
+
+    def check_intrinsics(module, library, replacements):
+        for ty in ltypes.integral:
+            for name in rewrites.int_intrinsics:
+                lfunc = module.get_function_named(
+                    mkname('my.int.%s' % name, ty))
+                assert not lfunc._ptr.list_use(), (name, ty)
+
+    ctx.link(rewrites=[check_intrinsics])
+    m = support.make_mod(ctx)
+
+    for ty in ltypes.integral:
+        for name in int_names:
+            f = getattr(m, mkname('my' + name, ty))
+            test_libs.check_int_function(f, name, ty.width)
+
+# ______________________________________________________________________
+
+# Half precision functions, not in all_replacements since halves aren't in
+# ltypes.all_types
+halfsinname = 'my.half.sin'
+halfpowname = 'my.half.pow'
+
+half_inputs = np.array([0.0, -0.0, 0.5, 1.0, -2.5, 1e-7, 6e-5, 1000.0,
+                        60000.0, np.inf, -np.inf, np.nan], np.float16)
+
+to_bits = lambda x: int(np.float16(x).view(np.int16))
+from_bits = lambda bits: np.int16(bits).view(np.float16)
+
+def make_half_conversion(ctx, name, emit, argtype, restype):
+    f = ctx.module.add_function(Type.function(restype, [argtype]), name)
+    b = Builder.new(f.append_basic_block('entry'))
+    b.ret(emit(b, f.args[0]))
+
+@test
+def test_half_conversions():
+    ctx = new_ctx(libs.get_mathlib_so(), linking.ExternalLibraryLinker())
+    make_half_conversion(ctx, 'tofloat', rewrites.emit_half_to_float,
+                         ltypes.l_half, ltypes.l_float)
+    make_half_conversion(ctx, 'tohalf', rewrites.emit_float_to_half,
+                         ltypes.l_float, ltypes.l_half)
+    ctx.module.verify()
+    m = support.make_mod(ctx)
+
+    halves = np.arange(2 ** 16, dtype=np.uint16).view(np.float16)
+    floats = np.array([m.tofloat(to_bits(h)) for h in halves], np.float32)
+    assert all(same_float(x, y) for x, y in zip(floats, halves))
+
+    # Ties, subnormals, overflow and values in between halves
+    floats = np.concatenate([floats, floats * np.float32(1 + 2.0 ** -11),
+                             floats * np.float32(1 + 2.0 ** -12),
+                             floats * np.float32(1 - 2.0 ** -13)])
+    with np.errstate(over='ignore', invalid='ignore'):
+        expected = floats.astype(np.float16)
+    for x, y in zip(floats, expected):
+        assert same_float(from_bits(m.tohalf(float(x))), y), x
+
+@parametrize(ctx=make_contexts())
+def test_promote_half(ctx):
+    ctx.replacements.update({halfsinname: rewrites.half_name('sin'),
+                             halfpowname: rewrites.half_name('pow')})
+    make_func(ctx, 'mysinhalf', halfsinname, ltypes.l_half)
+    make_func(ctx, 'mypowhalf', halfpowname, ltypes.l_half, nargs=2)
+
+    def check_promoted(module, library, replacements):
+        for name in (halfsinname, halfpowname):
+            assert not have_lfunc(module, name), name
+
+    ctx.link(rewrites=[check_promoted])
+    m = support.make_mod(ctx)
+
+    y = np.float16(2.5)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for x in half_inputs:
+            expected = np.float16(np.sin(np.float32(x)))
+            result = from_bits(m.mysinhalf(to_bits(x)))
+            assert same_float(result, expected), (x, result, expected)
+
+            expected = np.float16(np.power(np.float32(x), np.float32(y)))
+            result = from_bits(m.mypowhalf(to_bits(x), to_bits(y)))
+            assert same_float(result, expected), (x, result, expected)
+
+@parametrize(ctx=make_contexts())
+def test_promote_half_only_halves(ctx):
+    # i16 functions not replaced with a half name are on integers
+    ctx.replacements['my.int16.abs'] = 'abs'
+    make_func(ctx, 'myabs', 'my.int16.abs', ltypes.l_half)
+    try:
+        ctx.link()
+    except LookupError:
+        pass
+    else:
+        raise AssertionError("abs(i16) should not be promoted to float")
+
+# ______________________________________________________________________
+
+@parametrize(ctx=make_contexts())
+def test_inline_complex_arith(ctx):
+    ty = ltypes.l_complex128
+    make_func(ctx, 'myprod', mkname(prodname, ty), ty, nargs=2, byref=True)
+    make_func(ctx, 'myquot', mkname(quotname, ty), ty, nargs=2, byref=True)
+
+    def check_inlined(module, library, replacements):
+        for name in (prodname, quotname):
+            lfunc = module.get_function_named(mkname(name, ty))
+            assert not lfunc._ptr.list_use(), name
+
+    ctx.link(rewrites=[check_inlined])
+    m = support.make_mod(ctx)
+
+    x, y = 2+3j, 4-5j
+    assert np.allclose(support.call_complex_byref(m.myprod, x, y), x * y)
+    assert np.allclose(support.call_complex_byref(m.myquot, x, y), x / y)
+
+# ______________________________________________________________________
+
 @parametrize(ctx=make_contexts())
 def test_link_external(ctx):
     pass
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import os
+import math
+import types
+import shutil
+import tempfile
+
+from llvmmath import ltypes, linking, libs, objcache, llvm_support
+from llvmmath import have_llvm_asm
+from llvmmath.tests import support
+from llvmmath.tests.support import test, skip_if
+
+import llvm.core as lc
+
+# ______________________________________________________________________
+
+def make_sin_module():
+    "Create a module with mysin(x) calling an abstract sin(x)"
+    module = lc.Module.new("cached_module")
+    ty = ltypes.l_double
+    wrapped = module.get_or_insert_function(lc.Type.function(ty, [ty]),
+                                            'my.sin')
+    support.create_byval_wrapper(wrapped, 'mysin')
+
+    lib = libs.get_llvm_mathlib()
+    linking.link_llvm_math_intrinsics(None, module, lib, linking.LLVMLinker(),
+                                      { 'my.sin': 'sin' })
+    return module
+
+def call_sin(cache):
+    module = make_sin_module()
+    mod = types.ModuleType('cachedmod')
+    llvm_support.wrap_llvm_module(module, cache.engine(module), mod)
+    assert mod.mysin(10.0) == math.sin(10.0)
+
+@test
+@skip_if(not have_llvm_asm())
+def test_object_cache():
+    "Test compiling a module once and reloading it from the cache"
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = objcache.ObjectCache(cache_dir=tempdir)
+        call_sin(cache)
+        assert (cache.hits, cache.misses) == (0, 1)
+        call_sin(cache)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert len(os.listdir(tempdir)) == 1, os.listdir(tempdir)
+    finally:
+        shutil.rmtree(tempdir)
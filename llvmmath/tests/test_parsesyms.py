@@ -56,3 +56,43 @@ def test_comments():
     assert syms['sin'].name == 'sin'
     assert syms['sin'].restype == 'float'
     assert syms['sin'].argtypes == ('float',)
+
+
+testattrs = u"""
+float sin(float) [pure, nounwind] # comment
+float floor(float)   [pure, nounwind, noerrno]
+float cos(float)
+"""
+
+@test
+def test_attributes():
+    syms = symdict(parsesyms.parse_symbols(StringIO(testattrs)))
+    assert syms['sin'].attrs == ('pure', 'nounwind')
+    assert syms['sin'].argtypes == ('float',)
+    assert syms['floor'].attrs == ('pure', 'nounwind', 'noerrno')
+    assert syms['cos'].attrs == ()
+
+@test
+def test_unknown_attribute():
+    try:
+        parsesyms.parse_symbols(StringIO(u"float sin(float) [fast]"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected ValueError for unknown attribute")
+
+@test
+def test_pair():
+    syms = symdict(parsesyms.parse_symbols(StringIO(u"pair sincos(float)")))
+    assert syms['sincos'].restype == 'pair'
+    assert syms['sincos'].argtypes == ('float',)
+
+@test
+def test_unknown_type():
+    for line in (u"double sin(double)", u"float sin(pair)"):
+        try:
+            parsesyms.parse_symbols(StringIO(line))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected a ValueError for %r" % (line,))
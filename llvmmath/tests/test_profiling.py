@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import os
+import math
+import tempfile
+
+import numpy as np
+
+from llvmmath import (ltypes, profiling, libs, linking, rewrites,
+                      have_llvm_asm)
+from llvmmath.tests import support
+from llvmmath.tests.support import parametrize, test, skip_if
+from llvmmath.tests.test_linking import (make_contexts, new_ctx, make_func,
+                                         sinname, cosname, sqrtname,
+                                         floorname)
+
+# ______________________________________________________________________
+
+sig = ltypes.Signature(ltypes.l_double, [ltypes.l_double])
+
+def check_call_profiler(ctx, timers):
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    ctx.mkbyval('mycos', cosname, ltypes.l_double)
+
+    profiler = profiling.CallProfiler(timers=timers)
+    ctx.link(rewrites=[profiler])
+    m = support.make_mod(ctx)
+
+    for i in range(3):
+        m.mysin(float(i))
+    m.mycos(1.0)
+
+    profile = profiler.read(ctx.engine)
+    assert profile[('sin', sig)].calls == 3
+    assert profile[('cos', sig)].calls == 1
+    if timers:
+        assert profile[('sin', sig)].cycles > 0
+    else:
+        assert profile[('sin', sig)].cycles is None
+
+    profiler.reset(ctx.engine)
+    m.mycos(1.0)
+    profile = profiler.read(ctx.engine)
+    assert profile[('sin', sig)].calls == 0
+    assert profile[('cos', sig)].calls == 1
+
+@parametrize(timers=[False, True])
+def test_call_profiler(timers):
+    for ctx in make_contexts():
+        check_call_profiler(ctx, timers)
+
+# ______________________________________________________________________
+
+def record_ranges(ctx):
+    ctx.mkbyval('mysqrt', sqrtname, ltypes.l_double)
+    ctx.mkbyval('myfloor', floorname, ltypes.l_double)
+
+    profiler = profiling.RangeProfiler()
+    ctx.link(rewrites=[profiler])
+    m = support.make_mod(ctx)
+
+    for x in (0.0, 0.5, 4.0, 1e10):
+        m.mysqrt(x)
+    for x in (-2.5, 0.5, float('nan')):
+        m.myfloor(x)
+
+    return profiler.read(ctx.engine)
+
+@test
+def test_range_profiler():
+    for ctx in make_contexts():
+        profile = record_ranges(ctx)
+
+        # (-inf, -2**31 + 1), [-2**31 + 1, -1), [-1, 0), [0, 1), [1, 2**31),
+        # [2**31, inf), nan
+        assert profile['sqrt', sig] == [[0, 0, 0, 2, 1, 1, 0]]
+        assert profile['floor', sig] == [[0, 1, 0, 1, 0, 0, 1]]
+
+        assert profile.select('sqrt', sig)
+        assert not profile.select('floor', sig) # nan
+        assert not profile.select('trunc', sig) # not called
+        assert not profile.select('sin', sig) # no fast path
+
+        # Bin [0, 1) is not inside the open range (0, inf)
+        inf = float('inf')
+        assert profile.within('sqrt', sig, rewrites.Domain(0.0, inf, True))
+        assert not profile.within('sqrt', sig,
+                                  rewrites.Domain(0.0, inf, False))
+
+@test
+def test_range_profile_guided():
+    ctx, = make_contexts()[:1]
+    profile = record_ranges(ctx)
+
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        profile.save(filename)
+        profile = profiling.RangeProfile.load(filename)
+    finally:
+        os.remove(filename)
+
+    assert profile['sqrt', sig] == [[0, 0, 0, 2, 1, 1, 0]]
+
+    ctx = new_ctx(ctx.lib, ctx.linker)
+    ctx.mkbyval('mysqrt', sqrtname, ltypes.l_double)
+    ctx.mkbyval('myfloor', floorname, ltypes.l_double)
+
+    def check_guarded(module, library, replacements):
+        profile.rewrite(module, library, replacements)
+        guarded = [f.name for f in module.functions
+                       if f.name.startswith('llvmmath.guarded.')]
+        # Only sqrt, floor was called with a nan
+        assert len(guarded) == 1 and sqrtname in guarded[0], guarded
+
+    ctx.link(rewrites=[check_guarded])
+    m = support.make_mod(ctx)
+    assert m.mysqrt(4.0) == 2.0
+    assert math.isnan(m.mysqrt(-1.0)) # falls back to sqrt()
+    assert m.myfloor(-2.5) == -3.0
+
+# ______________________________________________________________________
+
+def header(lfunc):
+    "Get the definition line of a function, which lists its attributes"
+    return str(lfunc).split('{')[0]
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_inlining_hints():
+    lib = libs.get_llvm_mathlib()
+    profile = {
+        ('sin', sig): profiling.ProfileEntry(calls=5000, cycles=None),
+        ('cos', sig): profiling.ProfileEntry(calls=0, cycles=None),
+    }
+    linker = linking.LLVMLinker(profile=profile, hot_calls=1000)
+    ctx = new_ctx(lib, linker)
+    ctx.mkbyval('mysin', sinname, ltypes.l_double)
+    ctx.mkbyval('mycos', cosname, ltypes.l_double)
+    linking.link_llvm_math_intrinsics(ctx.engine, ctx.module, lib, linker,
+                                      ctx.replacements)
+
+    sin = ctx.module.get_function_named(lib.get_symbol('sin', sig).name)
+    cos = ctx.module.get_function_named(lib.get_symbol('cos', sig).name)
+    assert 'alwaysinline' in header(sin), header(sin)
+    assert 'noinline' in header(cos) and 'optsize' in header(cos), header(cos)
+
+    m = support.make_mod(ctx)
+    assert np.allclose([m.mysin(0.5), m.mycos(0.5)],
+                       [math.sin(0.5), math.cos(0.5)])
+
+@test
+@skip_if(not have_llvm_asm(), "llvm asm not available")
+def test_inlining_hints_unprofiled():
+    lib = libs.get_llvm_mathlib()
+    sig2 = ltypes.Signature(ltypes.l_double, [ltypes.l_double] * 2)
+    profile = {
+        ('logaddexp', sig2): profiling.ProfileEntry(calls=5000, cycles=None),
+    }
+    linker = linking.LLVMLinker(profile=profile, hot_calls=1000)
+    ctx = new_ctx(lib, linker)
+    ctx.replacements['my.logaddexp'] = 'logaddexp'
+    make_func(ctx, 'mylogaddexp', 'my.logaddexp', ltypes.l_double, nargs=2)
+    linking.link_llvm_math_intrinsics(ctx.engine, ctx.module, lib, linker,
+                                      ctx.replacements)
+
+    logaddexp = ctx.module.get_function_named(
+        lib.get_symbol('logaddexp', sig2).name)
+    assert 'alwaysinline' in header(logaddexp), header(logaddexp)
+
+    # Helpers called by logaddexp are not in the profile
+    for name in ('exp', 'log1p'):
+        helper = ctx.module.get_function_named(lib.get_symbol(name, sig).name)
+        for attr in ('alwaysinline', 'noinline', 'optsize'):
+            assert attr not in header(helper), header(helper)
+
+    m = support.make_mod(ctx)
+    assert np.allclose(m.mylogaddexp(0.5, 1.5),
+                       np.logaddexp(0.5, 1.5))
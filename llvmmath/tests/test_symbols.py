@@ -27,4 +27,17 @@ def test_duplicates():
     assert lib.get_symbol('abs', l.Signature(l.l_float, [l.l_complex64]))
     assert lib.get_symbol('abs', l.Signature(l.l_double, [l.l_complex128]))
     assert lib.get_symbol('abs', l.Signature(l.l_longdouble, [l.l_complex256]))
-    assert not lib.get_symbol('abs', l.Signature(l.l_complex64, [l.l_complex64]))
\ No newline at end of file
+    assert not lib.get_symbol('abs', l.Signature(l.l_complex64, [l.l_complex64]))
+@test
+def test_pairs():
+    "Only libraries that implement pair results get them"
+    syms = parsesyms.parse_symbols(StringIO(u"pair sincos(float)"))
+    sig = l.Signature(l.l_complex128, [l.l_double])
+
+    lib = symbols.get_symbols(libs.Library(None, None), MockLib(None), syms)
+    assert not lib.get_symbol('sincos', sig)
+    assert not lib.missing
+
+    lib = symbols.get_symbols(libs.Library(None, None),
+                              MockLib(None, pairs=True), syms)
+    assert lib.get_symbol('sincos', sig)
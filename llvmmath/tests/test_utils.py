@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import time
+import threading
+
+from llvmmath.utils import cached, _Memo
+from llvmmath.tests.support import test
+
+# ______________________________________________________________________
+
+@test
+def test_cached_arguments():
+    calls = []
+
+    @cached
+    def f(x, y=0):
+        calls.append((x, y))
+        return x + y
+
+    assert f(1) == f(1) == 1
+    assert f(2) == 2
+    assert f(1, y=2) == 3
+    assert calls == [(1, 0), (2, 0), (1, 2)]
+
+    f.invalidate(1)
+    assert f(1) == 1
+    assert len(calls) == 4
+
+    f.clear()
+    assert f(2) == 2
+    assert len(calls) == 5
+
+@test
+def test_cached_maxsize():
+    calls = []
+
+    @cached(maxsize=2)
+    def f(x):
+        calls.append(x)
+        return x
+
+    for x in (1, 2, 1, 3, 1, 2):
+        f(x)
+
+    # 2 was evicted by 3, as 1 was used more recently
+    assert calls == [1, 2, 3, 2]
+
+@test
+def test_cached_exception():
+    calls = []
+
+    @cached
+    def f():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ValueError
+        return len(calls)
+
+    try:
+        f()
+    except ValueError:
+        pass
+    assert f() == f() == 2
+
+@test
+def test_cached_single_flight():
+    calls = []
+
+    @cached
+    def f(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(f(1)))
+                   for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert len(results) == 8 and all(r is results[0] for r in results)
+
+class HookedLock(object):
+    "A lock that calls a hook after every release"
+
+    def __init__(self, hook):
+        self.lock = threading.Lock()
+        self.hook = hook
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        self.hook()
+
+@test
+def test_cached_done_window():
+    calls = []
+    results = []
+
+    def call_when_done():
+        # Call from another thread as soon as the result is no longer pending
+        if calls and not memo.pending and not results:
+            results.append(None)
+            t = threading.Thread(target=lambda: results.append(memo(1)))
+            t.start()
+            t.join()
+
+    def f(x):
+        calls.append(x)
+        return object()
+
+    memo = _Memo(f)
+    memo.lock = HookedLock(call_when_done)
+
+    result = memo(1)
+    assert calls == [1]
+    assert results == [None, result]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import
+
+import math
+
+import numpy as np
+
+from llvmmath import ltypes, libs, warmup
+from llvmmath.tests.support import test, skip_if
+
+# ______________________________________________________________________
+
+sig = ltypes.Signature(ltypes.l_double, [ltypes.l_double])
+
+def check(library):
+    sin = library.get_ctypes_symbol('sin', sig)
+    assert np.allclose(sin(0.5), math.sin(0.5))
+
+@test
+def test_warmup():
+    future = warmup.warmup(['sin', 'exp'])
+    library = future.result()
+    assert library is libs.get_default_math_lib()
+    check(library)
+
+@test
+def test_warmup_error():
+    future = warmup.warmup(['no_such_function'])
+    try:
+        future.result()
+    except LookupError:
+        pass
+    else:
+        raise AssertionError("Expected a LookupError")
+
+@test
+def test_warmup_without_futures():
+    Future = warmup.Future
+    warmup.Future = None # as without concurrent.futures
+    try:
+        future = warmup.warmup(['sin'])
+        error = warmup.warmup(['no_such_function'])
+    finally:
+        warmup.Future = Future
+
+    check(future.result())
+    assert future.done() and future.exception() is None
+    assert isinstance(error.exception(), LookupError)
+    try:
+        error.result()
+    except LookupError:
+        pass
+    else:
+        raise AssertionError("Expected a LookupError")
+
+@test
+@skip_if(warmup.Future is None, "concurrent.futures not available")
+def test_async_warmup():
+    try:
+        import asyncio
+    except ImportError:
+        return
+
+    loop = asyncio.new_event_loop()
+    try:
+        library = loop.run_until_complete(
+            warmup.async_warmup(['sin'], libs.get_mathlib_so, loop=loop))
+    finally:
+        loop.close()
+    check(library)
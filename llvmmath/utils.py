@@ -6,12 +6,103 @@ Utilities
 
 from __future__ import print_function, division, absolute_import
 
-def cached(f):
-    result = []
+import functools
+import threading
+import collections
+
+_missing = object()
+
+class _Memo(object):
+    """
+    Thread-safe memoization of a function keyed on its arguments. Concurrent
+    first calls with the same arguments compute the result only once, the
+    other threads wait for it. Exceptions are not cached.
+    """
+
+    def __init__(self, f, maxsize=None):
+        self.f = f
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.results = collections.OrderedDict() # key -> result
+        self.pending = {} # key -> lock held while computing the result
+
+    def key(self, args, kwargs):
+        if kwargs:
+            return args + (_missing,) + tuple(sorted(kwargs.items()))
+        return args
+
+    def __call__(self, *args, **kwargs):
+        key = self.key(args, kwargs)
+        with self.lock:
+            result = self.lookup(key)
+            if result is not _missing:
+                return result
+            pending = self.pending.get(key)
+            if pending is None:
+                pending = self.pending[key] = threading.RLock()
+
+        with pending:
+            # Another thread may have computed it while we were waiting
+            with self.lock:
+                result = self.lookup(key)
+            if result is not _missing:
+                return result
+
+            try:
+                result = self.f(*args, **kwargs)
+            except BaseException:
+                with self.lock:
+                    self.done(key, pending)
+                raise
+
+            # Store the result before callers stop waiting for it
+            with self.lock:
+                self.results[key] = result
+                if self.maxsize is not None:
+                    while len(self.results) > self.maxsize:
+                        self.results.popitem(last=False)
+                self.done(key, pending)
+
+        return result
+
+    def done(self, key, pending):
+        "Stop computing the result for key. Call with the lock held."
+        if self.pending.get(key) is pending:
+            del self.pending[key]
+
+    def lookup(self, key):
+        "Look up a result and mark it recently used. Call with the lock held."
+        result = self.results.pop(key, _missing)
+        if result is not _missing:
+            self.results[key] = result
+        return result
+
+    def invalidate(self, *args, **kwargs):
+        "Forget the result for the given arguments"
+        with self.lock:
+            self.results.pop(self.key(args, kwargs), None)
+
+    def clear(self):
+        "Forget all results"
+        with self.lock:
+            self.results.clear()
+
+def cached(f=None, maxsize=None):
+    """
+    Cache the results of f for each set of (hashable) arguments. Use as
+    @cached, or @cached(maxsize=N) to keep only the N most recently used
+    results. The decorated function has methods invalidate(*args, **kwargs)
+    and clear() to drop cached results.
+    """
+    if f is None:
+        return functools.partial(cached, maxsize=maxsize)
+
+    memo = _Memo(f, maxsize)
+
+    @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        if len(result) == 0:
-            ret = f(*args, **kwargs)
-            result.append(ret)
+        return memo(*args, **kwargs)
 
-        return result[0]
+    wrapper.invalidate = memo.invalidate
+    wrapper.clear = memo.clear
     return wrapper
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load a math library and compile its functions in a background thread, so
+applications can overlap it with their own startup:
+
+    >>> future = warmup.warmup(['sin', 'exp', 'pow'])
+    >>> ...
+    >>> library = future.result()
+
+or, in a coroutine:
+
+    >>> library = await warmup.async_warmup(['sin', 'exp', 'pow'])
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import threading
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    # Python 2 without the futures backport
+    Future = None
+
+from . import libs, llvm_support
+
+# ______________________________________________________________________
+
+def prepare(names=None, library=None):
+    """
+    Load the library and resolve and compile the given math functions (all
+    functions by default) for all their signatures. Returns the library.
+
+    :param library: a Library, or a callable returning one. Defaults to
+                    get_default_math_lib.
+    """
+    if library is None:
+        library = libs.get_default_math_lib
+    if callable(library):
+        library = library()
+
+    if names is None:
+        names = list(library.symbols)
+
+    for name in names:
+        if name not in library.symbols:
+            raise LookupError("Math function %r not available" % (name,))
+        if isinstance(library, libs.LLVMLibrary):
+            # Code generation uses the global LLVM context
+            with llvm_support.context_lock:
+                engine = library.get_engine()
+                for lfunc in library.symbols[name].values():
+                    engine.get_pointer_to_function(lfunc)
+
+    return library
+
+class _Future(object):
+    """
+    Result of a background warmup when concurrent.futures is not available.
+    Supports the result(), exception() and done() methods of
+    concurrent.futures.Future.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def set_running_or_notify_cancel(self):
+        return True
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def exception(self, timeout=None):
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise RuntimeError("Timed out waiting for the warmup")
+        return self._exception
+
+    def result(self, timeout=None):
+        if self.exception(timeout) is not None:
+            raise self._exception
+        return self._result
+
+def warmup(names=None, library=None, executor=None):
+    """
+    Run prepare(names, library) in the background. Returns a
+    concurrent.futures.Future of the library, or an object with the same
+    result(), exception() and done() methods if concurrent.futures is not
+    available.
+
+    :param executor: concurrent.futures.Executor to run in. By default, a
+                     new daemon thread is started.
+    """
+    if executor is not None:
+        return executor.submit(prepare, names, library)
+
+    if Future is None:
+        future = _Future()
+    else:
+        future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = prepare(names, library)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    thread = threading.Thread(target=run, name='llvmmath-warmup')
+    thread.daemon = True
+    thread.start()
+    return future
+
+def async_warmup(names=None, library=None, executor=None, loop=None):
+    "Like warmup(), but return an asyncio future that can be awaited"
+    import asyncio
+    return asyncio.wrap_future(warmup(names, library, executor), loop=loop)
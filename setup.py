@@ -128,8 +128,8 @@ setup(
     package_data={
         '': ['*.md', '*.cfg'],
         'llvmmath': ['*.txt'],
-        'llvmmath.mathcode': ['*.c', '*.h', '*.s', '*.src', '*.inc', '*.txt',
-                              'README', 'private/*.h'],
+        'llvmmath.mathcode': ['*.c', '*.h', '*.s', '*.bc', '*.src', '*.inc',
+                              '*.txt', '*.json', 'README', 'private/*.h'],
     },
     # data_files=[('llvmmath', ['logging.conf'])],
     ext_modules=[